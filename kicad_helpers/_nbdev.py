@@ -7,7 +7,9 @@ index = {"update_templates": "00_actions.ipynb",
          "install_git_filters": "00_actions.ipynb",
          "update_gitignore": "00_actions.ipynb",
          "update_project": "00_actions.ipynb",
+         "extract_bom": "00_actions.ipynb",
          "sch_to_bom": "00_actions.ipynb",
+         "back_annotate": "00_actions.ipynb",
          "bom_to_sch": "00_actions.ipynb",
          "export_manufacturing": "00_actions.ipynb",
          "export_sch": "00_actions.ipynb",
@@ -16,32 +18,110 @@ index = {"update_templates": "00_actions.ipynb",
          "run_drc": "00_actions.ipynb",
          "set_date": "00_actions.ipynb",
          "set_revision": "00_actions.ipynb",
+         "get_build_targets": "00_actions.ipynb",
+         "merge_kibot_configs": "00_actions.ipynb",
+         "build": "00_actions.ipynb",
+         "build_project": "00_actions.ipynb",
+         "plan_manufacturing": "00_actions.ipynb",
+         "export_all_manufacturers": "00_actions.ipynb",
          "test_erc": "01_test.ipynb",
          "test_drc": "01_test.ipynb",
+         "read_bom": "01_test.ipynb",
+         "explode_bom_refs": "01_test.ipynb",
+         "check_bom": "01_test.ipynb",
          "validate_bom": "01_test.ipynb",
+         "load_test_history": "01_test.ipynb",
+         "KernelPool": "01_test.ipynb",
+         "run_test_notebooks": "01_test.ipynb",
          "test_notebooks": "01_test.ipynb",
+         "trace_span": "02_utilities.ipynb",
+         "start_profiling": "02_utilities.ipynb",
+         "stop_profiling": "02_utilities.ipynb",
+         "profile_summary": "02_utilities.ipynb",
+         "profiled": "02_utilities.ipynb",
+         "run_cmd_async": "02_utilities.ipynb",
+         "run_cmd": "02_utilities.ipynb",
          "get_git_root": "02_utilities.ipynb",
          "setup_test_repo": "02_utilities.ipynb",
+         "KicadProject": "02_utilities.ipynb",
+         "get_project": "02_utilities.ipynb",
          "get_project_name": "02_utilities.ipynb",
          "get_project_metadata": "02_utilities.ipynb",
          "get_schematic_path": "02_utilities.ipynb",
          "get_bom_path": "02_utilities.ipynb",
          "get_board_path": "02_utilities.ipynb",
          "get_manufacturers": "02_utilities.ipynb",
+         "GitignoreMatcher": "02_utilities.ipynb",
+         "get_gitignore_matcher": "02_utilities.ipynb",
          "get_gitignore_list": "02_utilities.ipynb",
          "in_gitignore": "02_utilities.ipynb",
+         "run_docker_cmd_async": "02_utilities.ipynb",
          "run_docker_cmd": "02_utilities.ipynb",
+         "stop_docker_containers": "02_utilities.ipynb",
          "run_kibot_docker": "02_utilities.ipynb",
+         "SexprAtom": "02_utilities.ipynb",
+         "SexprNode": "02_utilities.ipynb",
+         "parse_sexpr": "02_utilities.ipynb",
+         "find_sexpr": "02_utilities.ipynb",
          "get_board_metadata": "02_utilities.ipynb",
          "update_board_metadata": "02_utilities.ipynb",
+         "SchematicComponent": "02_utilities.ipynb",
+         "SchematicSheet": "02_utilities.ipynb",
+         "Schematic": "02_utilities.ipynb",
+         "get_schematic": "02_utilities.ipynb",
+         "get_sheet_instances": "02_utilities.ipynb",
+         "get_schematic_hierarchy": "02_utilities.ipynb",
+         "get_schematic_components": "02_utilities.ipynb",
          "get_schematic_metadata": "02_utilities.ipynb",
          "update_schematic_metadata": "02_utilities.ipynb",
+         "parse_check_report": "02_utilities.ipynb",
+         "Violation": "02_utilities.ipynb",
+         "Violation.__doc__": "02_utilities.ipynb",
+         "CheckResult": "02_utilities.ipynb",
+         "CheckResults": "02_utilities.ipynb",
+         "run_check": "02_utilities.ipynb",
          "github_badge": "02_utilities.ipynb",
-         "kitspace_badge": "02_utilities.ipynb"}
+         "kitspace_badge": "02_utilities.ipynb",
+         "find_projects": "03_batch.ipynb",
+         "run_batch": "03_batch.ipynb",
+         "batch": "03_batch.ipynb",
+         "benchmark_startup": "04_cli.ipynb",
+         "main": "04_cli.ipynb",
+         "check_project": "05_daemon.ipynb",
+         "ProjectDaemon": "05_daemon.ipynb",
+         "serve_daemon": "05_daemon.ipynb",
+         "daemon_request": "05_daemon.ipynb",
+         "daemon": "05_daemon.ipynb",
+         "daemon_client": "05_daemon.ipynb",
+         "PartInfoCache": "06_parts.ipynb",
+         "PartInfoBackend": "06_parts.ipynb",
+         "JsonPartInfoBackend": "06_parts.ipynb",
+         "KitspacePartInfoBackend": "06_parts.ipynb",
+         "get_part_info": "06_parts.ipynb",
+         "enrich_bom": "06_parts.ipynb",
+         "make_synthetic_project": "07_benchmarks.ipynb",
+         "run_benchmarks": "07_benchmarks.ipynb",
+         "compare_benchmarks": "07_benchmarks.ipynb",
+         "benchmarks": "07_benchmarks.ipynb",
+         "clean_pro": "08_gitfilter.ipynb",
+         "filter_sch": "08_gitfilter.ipynb",
+         "filter_content": "08_gitfilter.ipynb",
+         "git_filter_process": "08_gitfilter.ipynb",
+         "get_input_actions": "09_affected.ipynb",
+         "get_changed_paths": "09_affected.ipynb",
+         "find_affected": "09_affected.ipynb",
+         "affected": "09_affected.ipynb"}
 
 modules = ["actions.py",
            "test.py",
-           "utilities.py"]
+           "utilities.py",
+           "batch.py",
+           "cli.py",
+           "daemon.py",
+           "parts.py",
+           "benchmarks.py",
+           "gitfilter.py",
+           "affected.py"]
 
 doc_url = "https://ryanfobel.github.io/kicad-helpers/"
 
@@ -1,61 +1,102 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: notebooks/00_actions.ipynb (unless otherwise specified).
 
-__all__ = ['update_templates', 'add_badges', 'install_git_filters', 'update_gitignore', 'update_project', 'sch_to_bom',
-           'bom_to_sch', 'export_manufacturing', 'export_sch', 'export_pcb', 'run_erc', 'run_drc', 'set_date',
-           'set_revision']
+__all__ = ['update_templates', 'add_badges', 'install_git_filters', 'update_gitignore', 'update_project', 'extract_bom',
+           'sch_to_bom', 'back_annotate', 'bom_to_sch', 'export_manufacturing', 'export_sch', 'export_pcb', 'run_erc',
+           'run_drc', 'set_date', 'set_revision', 'get_build_targets', 'merge_kibot_configs', 'build', 'build_project',
+           'plan_manufacturing', 'export_all_manufacturers']
 
 # Cell
 import os
 import sys
-import pkg_resources
 import subprocess
 from pprint import pprint
 import datetime as dt
+import posixpath
+import re
+import hashlib
+import json
+import shlex
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import jinja2
 from fastcore.script import *
-import pandas as pd
-from kifield.kifield import explode
+import yaml
 
 from kicad_helpers import *
-from .utilities import _set_root, _run_cmd, _print_cmd_output
+from .utilities import _set_root, _run_cmd, _print_cmd_output, _cache_dir, _inputs_key, _run_with_output_cache
+from .utilities import _output_files, _kibot_inputs, _kibot_output_dirs
 
 # Cell
+_template_envs = {}
+
+def _get_template_env(templates_path):
+    """Get a shared `jinja2.Environment` for the templates in `templates_path`,
+    with compiled templates cached in the `jinja` directory of the cache
+    directory (see `KH_CACHE_DIR`).
+    """
+    import jinja2
+
+    if templates_path not in _template_envs:
+        cache_path = os.path.join(_cache_dir(), "jinja")
+        os.makedirs(cache_path, exist_ok=True)
+        _template_envs[templates_path] = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(templates_path),
+            bytecode_cache=jinja2.FileSystemBytecodeCache(cache_path)
+        )
+    return _template_envs[templates_path]
+
+def _render_template(env, path, dst_path, metadata):
+    """Render the template `path` to `dst_path`, unless the file already has
+    the same content. Returns `True` if the file was written.
+    """
+    with trace_span("render template", "template", path=path):
+        content = env.get_template(path.replace(os.sep, "/")).render(**metadata)
+    try:
+        with open(dst_path) as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+
+    # Create the `dst_path` directory if it doesn't exist
+    os.makedirs(os.path.split(dst_path)[0], exist_ok=True)
+    with open(dst_path, "w") as f:
+        f.write(content)
+    return True
+
 def update_templates(v:Param("verbose", bool),
                      overwrite:Param("overwrite existing templates", bool),
                      root:Param("project root directory", str)="."):
     """Install templates from the `kicad_helpers/templates` directory (ignoring
-    anything in the project's `.gitignore` list).
+    anything in the project's `.gitignore` list). Templates are rendered in
+    parallel, and files whose content wouldn't change aren't rewritten.
     """
+    import pkg_resources
+
     templates_path = os.path.abspath(pkg_resources.resource_filename('kicad_helpers', 'templates'))
     root = _set_root(root)
     metadata = get_project_metadata(root)
+    env = _get_template_env(templates_path)
     file_list = []
     exists_flag = False
     for root_, dirs, files in os.walk(templates_path):
-        if len(files):
-            for file in files:
-                path = os.path.join(root_[len(templates_path) + 1:], file)
-                if not in_gitignore(path, root):
-                    src_path = os.path.abspath(os.path.join(templates_path, path))
-                    dst_path = os.path.abspath(os.path.join(root, path))
-
-                    # Create the `dst_path` directory if it doesn't exist
-                    os.makedirs(os.path.split(dst_path)[0], exist_ok=True)
-
-                    if os.path.exists(dst_path):
-                        if not overwrite:
-                            print(f"{ path } already exists")
-                            exists_flag = True
-                            continue
-
-                    with open(src_path) as f:
-                        template = jinja2.Template(f.read())
-
-                    with open(dst_path, "w") as f:
-                        if v:
-                            print(f"Render { path } template.")
-                        f.write(template.render(**metadata))
+        for file in sorted(files):
+            path = os.path.join(root_[len(templates_path) + 1:], file)
+            if not in_gitignore(path, root):
+                dst_path = os.path.abspath(os.path.join(root, path))
+                if os.path.exists(dst_path) and not overwrite:
+                    print(f"{ path } already exists")
+                    exists_flag = True
+                    continue
+                file_list.append((path, dst_path))
+
+    with ThreadPoolExecutor() as pool:
+        written = list(pool.map(lambda args: _render_template(env, *args, metadata), file_list))
+    if v:
+        for (path, dst_path), changed in zip(file_list, written):
+            print(f"Render { path } template." if changed else f"{ path } is up to date.")
 
     if not overwrite and exists_flag:
         print("To overwrite existing files, use the --overwrite flag.")
@@ -69,6 +110,7 @@ def _add_lines_to_file(root, file_name, lines, v=False, prepend=False):
     else:
         file_lines = []
 
+    original_lines = list(file_lines)
     for line in lines:
         if line not in file_lines:
             if v:
@@ -80,10 +122,13 @@ def _add_lines_to_file(root, file_name, lines, v=False, prepend=False):
         elif v:
             print(f"\"{ line.strip() }\" already exists in { file_path }")
 
-    with open(file_path, "w") as f:
-        f.writelines(file_lines)
+    # Don't touch the file if nothing was added
+    if file_lines != original_lines or not os.path.exists(file_path):
+        with open(file_path, "w") as f:
+            f.writelines(file_lines)
 
 # Cell
+@profiled
 @call_parse
 def add_badges(root:Param("project root directory", str)=".",
                v:Param("verbose", bool)=False,
@@ -110,7 +155,9 @@ _gitattributes_list = ["*.pro filter=kicad_project",
 
 def install_git_filters(root=".", v=False):
     """Install git filters to prevent insignificant changes to the kicad
-    `*.pro` and `*.sch` files from being tracked by git.
+    `*.pro` and `*.sch` files from being tracked by git. Both use a single
+    long-running `kh_git_filter` process per git command (see
+    `kicad_helpers.gitfilter`).
 
     See: https://jnavila.github.io/plotkicadsch/
     """
@@ -126,12 +173,11 @@ def install_git_filters(root=".", v=False):
         print("Add filters to git config.")
 
     # Add filters to the project's git config
-    _run_cmd(f"cd { root } && git config filter.kicad_project.clean \"sed -E 's/^update=.*$/update=Date/'\"")
-    _run_cmd(f"cd { root } && git config filter.kicad_project.smudge cat")
-
-    # This seems to break ERC checking. Disable for now...
-    #_run_cmd(f"cd { root } && git config filter.kicad_sch.clean \"sed -E 's/#(PWR|FLG)[0-9]+/#\1?/'\"")
-    #_run_cmd(f"cd { root } && git config filter.kicad_sch.smudge cat")
+    for driver in ["kicad_project", "kicad_sch"]:
+        _run_cmd(["git", "config", f"filter.{ driver }.process", "kh_git_filter"], cwd=root)
+        # Remove the per-file `sed` filters installed by previous versions
+        for key in ["clean", "smudge"]:
+            subprocess.run(["git", "config", "--unset", f"filter.{ driver }.{ key }"], cwd=root)
 
 # Cell
 
@@ -164,6 +210,7 @@ def update_gitignore(root=".", v=False):
     )
 
 # Cell
+@profiled
 @call_parse
 def update_project(v:Param("verbose", bool),
                    overwrite:Param("overwrite existing templates", bool),
@@ -179,67 +226,151 @@ def update_project(v:Param("verbose", bool),
     update_gitignore(root=root, v=v)
 
 # Cell
+def extract_bom(root="."):
+    """Extract a BOM from the schematic hierarchy as a `pandas.DataFrame`
+    with one row for each unique combination of field values.
+
+    If the project already has a BOM file, its columns (and the values of
+    any fields that are only in the BOM) are kept, but fields from the
+    schematic take precedence.
+    """
+    import pandas as pd
+    from kifield.kifield import collapse, explode
+
+    project = get_project(root)
+
+    # Collect the fields for each reference (earlier units take precedence)
+    parts = {}
+    for ref, units in get_schematic_components(project).items():
+        fields = parts.setdefault(ref, {})
+        for schematic, component in units:
+            for name, value in component.fields.items():
+                if name != "reference":
+                    fields.setdefault(name, value)
+
+    # Merge with the existing BOM
+    columns = []
+    if os.path.exists(project.bom_path):
+        with trace_span("read BOM", "io", path=project.bom_path):
+            bom = pd.read_csv(project.bom_path, dtype=str, keep_default_na=False)
+        columns = [column for column in bom.columns if column not in ("Refs", "Quantity")]
+        for row in bom.to_dict("records"):
+            refs = row.pop("Refs")
+            row.pop("Quantity", None)
+            for ref in explode(refs):
+                parts[ref] = {**row, **parts.get(ref, {})}
+    columns += sorted({name for fields in parts.values() for name in fields} - set(columns))
+
+    # Group references with identical fields
+    groups = {}
+    for ref, fields in parts.items():
+        groups.setdefault(tuple(fields.get(column, "") for column in columns), []).append(ref)
+
+    df = pd.DataFrame(list(groups), columns=columns)
+    df.insert(0, "Refs", [collapse(refs) for refs in groups.values()])
+    df.insert(1, "Quantity", [len(refs) for refs in groups.values()])
+
+    # Sort alphabetically by Ref
+    return df.sort_values(by="Refs", ignore_index=True)
+
+# Cell
+@profiled
 @call_parse
 def sch_to_bom(root:Param("project root directory", str)=".",
                v:Param("verbose", bool)=False,
                overwrite:Param("update existing schematic", bool)=False):
     """Update/create BOM from KiCad schematic.
     """
-    root = _set_root(root)
-    cmd = f"{ sys.executable } -m kifield -r --nobackup --overwrite --group -x { get_schematic_path(root) } -i { get_bom_path(root) }"
+    project = get_project(root)
+    df = extract_bom(project)
+    os.makedirs(os.path.dirname(project.bom_path), exist_ok=True)
+    with trace_span("write BOM", "io", path=project.bom_path):
+        df.to_csv(project.bom_path, index=False)
     if v:
-        print(cmd)
-    _print_cmd_output(cmd)
-
-    # Open the BOM
-    df = pd.read_csv(get_bom_path(root))
-
-    # Calculate the quantity of each part
-    df["Quantity"] = [len(explode(refs)) for refs in df["Refs"]]
+        print(f"Wrote { df['Quantity'].sum() } parts ({ len(df) } lines) to { project.bom_path }")
 
-    # Make quantity the second column
-    if df.columns[-1] == "Quantity":
-        df = df[[df.columns[0]] + ["Quantity"] + list(df.columns[1:-1])]
+# Cell
+def back_annotate(root=".", v=False):
+    """Update the schematic hierarchy with the fields from the project's BOM.
 
-    # Sort alphabetically by Ref
-    df.sort_values(by="Refs", inplace=True)
-    df.to_csv(get_bom_path(root), index=False)
+    Only the fields whose values differ from the BOM are changed (empty BOM
+    values are ignored), and only the sheets containing them are written.
+    Returns a list of `(ref, name, old_value, new_value)` tuples.
+    """
+    import pandas as pd
+    from kifield.kifield import explode
+
+    project = get_project(root)
+    with trace_span("read BOM", "io", path=project.bom_path):
+        bom = pd.read_csv(project.bom_path, dtype=str, keep_default_na=False)
+
+    fields = [column for column in bom.columns if column not in ("Refs", "Quantity")]
+    bom_fields = {}
+    for row in bom.to_dict("records"):
+        for ref in explode(row["Refs"]):
+            bom_fields[ref] = {name: row[name] for name in fields if row[name] != ""}
+
+    changes = []
+    changed_schematics = []
+    for ref, units in get_schematic_components(project).items():
+        if ref not in bom_fields:
+            continue
+        for schematic, component in units:
+            for name, old_value, new_value in schematic.set_component_fields(component, bom_fields[ref]):
+                changes.append((ref, name, old_value, new_value))
+                if v:
+                    print(f"{ ref }: { name } { old_value !r} -> { new_value !r} ({ os.path.basename(schematic.path) })")
+                if schematic not in changed_schematics:
+                    changed_schematics.append(schematic)
+
+    for schematic in changed_schematics:
+        schematic.save()
+    return changes
 
 # Cell
+@profiled
 @call_parse
 def bom_to_sch(root:Param("project root directory", str)=".",
                v:Param("verbose", bool)=False,
                overwrite:Param("update existing schematic", bool)=False):
-    """Update KiCad schematic from BOM file.
+    """Update KiCad schematic from BOM file. Only fields that differ from
+    the BOM are changed.
     """
-    root = _set_root(root)
-    cmd = f"{ sys.executable } -m kifield -r --nobackup --overwrite --fields ~Quantity -x { get_bom_path(root) } -i { get_schematic_path(root) }"
-    if v:
-        print(cmd)
-    _print_cmd_output(cmd)
+    changes = back_annotate(root, v=v)
+    print(f"Updated { len(changes) } field{ '' if len(changes) == 1 else 's' }.")
 
 # Cell
+@profiled
 @call_parse
 def export_manufacturing(root:Param("project root directory", str)=".",
                          manufacturer:Param(f"\"default\" or manufacturer name", str)="default",
                          v:Param("verbose", bool)=False,
-                         output:Param("output path relative to ROOT")="."):
+                         output:Param("output path relative to ROOT")=".",
+                         no_cache:Param("don't use the output cache", bool)=False,
+                         all:Param("export the files of all manufacturers to OUTPUT/MANUFACTURER", bool)=False,
+                         zip:Param("package the files of each manufacturer in a zip archive (with --all)", bool)=False):
     """Export manufacturing files (gerber, drill, and position) by running
     KiBot in a local docker container.
     """
-    root = _set_root(root)
-    if manufacturer not in get_manufacturers(root):
-        raise RuntimeError(f"MANUFACTURER must be one of the following: { ', '.join(get_manufacturers(root)) }.")
+    project = get_project(root)
+    if all:
+        return export_all_manufacturers(project, output=output, v=v, cache=not no_cache, zip_outputs=zip)
+    if zip:
+        raise RuntimeError("ZIP is only supported with ALL.")
+    if manufacturer not in project.manufacturers:
+        raise RuntimeError(f"MANUFACTURER must be one of the following: { ', '.join(project.manufacturers) }.")
 
     config = f".kicad_helpers_config/manufacturers/{ manufacturer }.yaml"
-    run_kibot_docker(config=config, root=root, v=v, output=output)
+    run_kibot_docker(config=config, root=project, v=v, output=output, cache=not no_cache)
 
 # Cell
+@profiled
 @call_parse
 def export_sch(root:Param("project root directory", str)=".",
                ext:Param(f"svg or pdf", str)="pdf",
                v:Param("verbose", bool)=False,
-               output:Param("output path relative to ROOT")="."):
+               output:Param("output path relative to ROOT")=".",
+               no_cache:Param("don't use the output cache", bool)=False):
     """Export the schematic by running KiBot in a local docker container.
     """
     root = _set_root(root)
@@ -249,14 +380,16 @@ def export_sch(root:Param("project root directory", str)=".",
         raise RuntimeError(f"EXT must be one of: { ','.join(supported_types) }.")
 
     config = f".kicad_helpers_config/sch_{ ext }.yaml"
-    run_kibot_docker(config=config, root=root, v=v, output=output)
+    run_kibot_docker(config=config, root=root, v=v, output=output, cache=not no_cache)
 
 # Cell
+@profiled
 @call_parse
 def export_pcb(root:Param("project root directory", str)=".",
                ext:Param(f"svg or pdf", str)="pdf",
                v:Param("verbose", bool)=False,
-               output:Param("output path relative to ROOT")="."):
+               output:Param("output path relative to ROOT")=".",
+               no_cache:Param("don't use the output cache", bool)=False):
     """Export the pcb layout by running KiBot in a local docker container.
     """
     root = _set_root(root)
@@ -266,80 +399,292 @@ def export_pcb(root:Param("project root directory", str)=".",
         raise RuntimeError(f"EXT must be one of: { ','.join(supported_types) }.")
 
     config = f".kicad_helpers_config/pcb_{ ext }.yaml"
-    run_kibot_docker(config=config, root=root, v=v, output=output)
+    run_kibot_docker(config=config, root=root, v=v, output=output, cache=not no_cache)
 
 # Cell
+@profiled
 @call_parse
 def run_erc(root:Param("project root directory", str)=".",
-            v:Param("verbose", bool)=False):
+            v:Param("verbose", bool)=False,
+            changes:Param("only print the violations that are new or resolved since the last check", bool)=False,
+            no_cache:Param("run the check even if the schematic hasn't changed", bool)=False):
     """Run electrical rules check (ERC) to verify schematic connections. It
     checks for output pin conflicts, missing drivers and unconnected pins.
     Print the report to `stdout`.
     """
-    root = _set_root(root)
-    cmd = f"eeschema_do run_erc { get_schematic_path(root)[len(root) + 1:] } ."
-    try:
-        output = run_docker_cmd(cmd,
-           workdir=os.path.abspath(root),
-           container="setsoft/kicad_auto_test:latest",
-           v=v
-        )
-    except subprocess.CalledProcessError as e:
-        output = e.output.decode("utf-8")
-    if v:
-        print(output)
-    erc_path = os.path.join(root, get_project_name(root) + ".erc")
-    with open(erc_path, "r") as f:
-        erc = f.read()
-    os.remove(erc_path)
-    print(erc)
+    result = run_check("erc", root, v=v, cache=not no_cache)
+    print(result.summary() if changes else result.report)
 
 # Cell
+@profiled
 @call_parse
 def run_drc(root:Param("project root directory", str)=".",
-            v:Param("verbose", bool)=False):
+            v:Param("verbose", bool)=False,
+            changes:Param("only print the violations that are new or resolved since the last check", bool)=False,
+            no_cache:Param("run the check even if the board hasn't changed", bool)=False):
     """Run design rules check (DRC) and print the report to `stdout`.
     """
-    root = _set_root(root)
-    cmd = f"pcbnew_do run_drc { get_board_path(root)[len(root) + 1:] } ."
-    try:
-        output = run_docker_cmd(cmd,
-            workdir=os.path.abspath(root),
-            container="setsoft/kicad_auto_test:latest",
-            v=v
-        )
-    except subprocess.CalledProcessError as e:
-        output = e.output.decode("utf-8")
-    if v:
-        print(output)
-    drc_path = os.path.join(root, "drc_result.rpt")
-    with open(drc_path, "r") as f:
-        drc = f.read()
-    os.remove(drc_path)
-    print(drc)
+    result = run_check("drc", root, v=v, cache=not no_cache)
+    print(result.summary() if changes else result.report)
 
 # Cell
+@profiled
 @call_parse
 def set_date(date:Param("date (defaults to today's date)", str)=None,
              root:Param("project root directory", str)=".",
              v:Param("verbose", bool)=False):
     """Set the date in all schematic and board files.
     """
-    root = _set_root(root)
+    project = get_project(root)
     if date is None:
         date = dt.datetime.now().date().isoformat()
     update_schematic_metadata({"Date": date},
-                              root=root, all_sheets=True)
-    update_board_metadata({"date": date}, root=root)
+                              root=project, all_sheets=True)
+    update_board_metadata({"date": date}, root=project)
 
 # Cell
+@profiled
 @call_parse
 def set_revision(revision:Param("revision", str),
                  root:Param("project root directory", str)=".",
                  v:Param("verbose", bool)=False):
     """Set the revision in all schematic and board files.
     """
-    root = _set_root(root)
+    project = get_project(root)
     update_schematic_metadata({"Rev": revision},
-                              root=root, all_sheets=True)
-    update_board_metadata({"rev": revision}, root=root)
\ No newline at end of file
+                              root=project, all_sheets=True)
+    update_board_metadata({"rev": revision}, root=project)
+
+# Cell
+def get_build_targets(root="."):
+    """Get a dictionary mapping the name of each KiBot config that `kh_build`
+    can run to a `(config, output)` tuple, where `config` is the path of the
+    config file and `output` is the directory (relative to the project root)
+    that its outputs are written to.
+    """
+    project = get_project(root)
+    targets = {"erc": (".kicad_helpers_config/erc.yaml", "."),
+               "drc": (".kicad_helpers_config/drc.yaml", ".")}
+    for manufacturer in project.manufacturers:
+        targets[manufacturer] = (f".kicad_helpers_config/manufacturers/{ manufacturer }.yaml",
+                                 posixpath.join("manufacturing", manufacturer))
+    for ext in ["pdf", "svg"]:
+        for kind in ["sch", "pcb"]:
+            targets[f"{ kind }_{ ext }"] = (f".kicad_helpers_config/{ kind }_{ ext }.yaml",
+                                           posixpath.join("docs", ext))
+    return {name: target for name, target in targets.items()
+            if os.path.exists(os.path.join(project.root, target[0]))}
+
+# Cell
+def merge_kibot_configs(targets, root="."):
+    """Merge the KiBot configs in `targets` (a dictionary of `(config, output)`
+    tuples, see `get_build_targets`) into a single config.
+
+    Global and preflight options are combined (lists are concatenated and
+    later targets override any other values), and the `dir` of each output is
+    prefixed with the output directory of its target. Returns the merged
+    config and a dictionary mapping the name of each output to its target.
+    """
+    project = get_project(root)
+    merged = {"kibot": {"version": 1}}
+    owners = {}
+    for target, (config, output) in targets.items():
+        with open(os.path.join(project.root, config)) as f:
+            data = yaml.safe_load(f) or {}
+        for section in ["global", "preflight"]:
+            for key, value in (data.get(section) or {}).items():
+                options = merged.setdefault(section, {})
+                if isinstance(value, list) and isinstance(options.get(key), list):
+                    options[key] = options[key] + value
+                else:
+                    options[key] = value
+        for out in data.get("outputs") or []:
+            out = dict(out)
+            if out["name"] in owners:
+                out["name"] = f"{ target }_{ out['name'] }"
+            out["dir"] = posixpath.normpath(posixpath.join(output, out.get("dir", ".")))
+            merged.setdefault("outputs", []).append(out)
+            owners[out["name"]] = target
+    return merged, owners
+
+# Cell
+_kibot_output_line = re.compile(r"^(?P<time>[\d.]+) - .*\((?P<name>[^()]+)\) \[[\w.]+\]\s*$")
+
+def build(root=".", targets=None, v=False, cache=True):
+    """Run the KiBot configs named in `targets` (all of the configs from
+    `get_build_targets` by default) in a single KiBot run, so the schematic
+    and board are only loaded once.
+
+    Returns a list of `(name, target, seconds)` tuples with the time spent on
+    loading the project and running the preflights (e.g., ERC and DRC), and
+    on each output. If `cache` is `True` and the outputs of an identical build
+    are in the output cache, they are restored instead (and the time taken is
+    reported as a single "cache" step).
+    """
+    project = get_project(root)
+    available = get_build_targets(project)
+    if targets is None:
+        targets = list(available)
+    if not set(targets) <= set(available):
+        raise RuntimeError(f"TARGETS must be in the following: { ', '.join(available) }.")
+    config, owners = merge_kibot_configs({target: available[target] for target in targets}, project)
+
+    # Write the merged config and a script that timestamps each line of
+    # KiBot's output to the project directory (i.e., the docker workdir)
+    config_text = yaml.safe_dump(config, sort_keys=False)
+    fd, config_path = tempfile.mkstemp(prefix=".kh_build-", suffix=".yaml", dir=project.root)
+    script_path = config_path[:-len(".yaml")] + ".sh"
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(config_text)
+        with open(script_path, "w") as f:
+            f.write("set -o pipefail\n"
+                    "{ echo start; "
+                    f"kibot -c { shlex.quote(os.path.basename(config_path)) } "
+                    f"-e { shlex.quote(project.schematic_path[len(project.root) + 1:]) } "
+                    f"-b { shlex.quote(project.board_path[len(project.root) + 1:]) } -d . 2>&1; "
+                    "status=$?; echo end; exit $status; } | "
+                    "while IFS= read -r line; do echo \"${EPOCHREALTIME:-$(date +%s.%N)} $line\"; done\n")
+        container = "setsoft/kicad_auto_test:latest"
+        run = lambda: run_docker_cmd(["bash", os.path.basename(script_path)],
+                                     workdir=os.path.abspath(project.root),
+                                     container=container,
+                                     v=v).decode("utf-8")
+        start = time.time()
+        try:
+            if cache:
+                # Key on the merged config (not its temporary file), and
+                # only store the files in the output directories
+                config_hash = hashlib.sha256(config_text.encode("utf-8")).hexdigest()
+                key_fn = lambda: _inputs_key(project, _kibot_inputs(project), container, config_hash, "kh_build")
+                output, hit = _run_with_output_cache(key_fn, project.root, run, v=v, dirs=_kibot_output_dirs(config))
+                if hit:
+                    return [("cache", None, time.time() - start)]
+            else:
+                output = run()
+        except subprocess.CalledProcessError as e:
+            print(e.output.decode("utf-8"))
+            raise
+    finally:
+        for path in [config_path, script_path,
+                     os.path.join(project.root, project.name + ".erc"),
+                     os.path.join(project.root, "drc_result.rpt")]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    lines = [line.split(" ", 1) for line in output.splitlines()]
+    if v:
+        print("\n".join(line[1] for line in lines if len(line) == 2 and line[1] not in ("start", "end")))
+
+    # Each output takes until the next one starts
+    steps = [("preflight", None, float(lines[0][0]))]
+    for line in output.splitlines():
+        m = _kibot_output_line.match(line)
+        if m and m.group("name") in owners:
+            steps.append((m.group("name"), owners[m.group("name")], float(m.group("time"))))
+    end = float(lines[-1][0])
+    return [(name, target, max(0., (steps[i + 1][2] if i + 1 < len(steps) else end) - start))
+            for i, (name, target, start) in enumerate(steps)]
+
+# Cell
+@profiled
+@call_parse
+def build_project(root:Param("project root directory", str)=".",
+                  targets:Param("comma separated list of targets (defaults to all)", str)=None,
+                  v:Param("verbose", bool)=False,
+                  no_cache:Param("don't use the output cache", bool)=False):
+    """Run ERC/DRC and export the manufacturing files, schematics and board
+    layouts in a single KiBot run, and print the time taken by each output.
+    """
+    timings = build(root, targets=None if targets is None else targets.split(","), v=v, cache=not no_cache)
+    for name, target, seconds in timings:
+        print(f"{ seconds :8.1f}s  { name if target is None else f'{ target }/{ name }' }")
+    print(f"{ sum(seconds for name, target, seconds in timings) :8.1f}s  total")
+
+# Cell
+_shared_output_keys = {"name", "comment", "dir"}
+
+def plan_manufacturing(root=".", manufacturers=None):
+    """Merge the KiBot configs of `manufacturers` (all of the project's
+    manufacturers by default) into a single config, where outputs that only
+    differ in their name, comment and directory (e.g., the same copper layers
+    plotted with the same options) are plotted once.
+
+    Returns the merged config and a dictionary mapping each manufacturer to a
+    list of `(plot, dir)` tuples, where `plot` is the directory of a shared
+    output (relative to KiBot's output directory) and `dir` is the directory
+    its files are copied to in the manufacturer's outputs.
+    """
+    project = get_project(root)
+    if manufacturers is None:
+        manufacturers = project.manufacturers
+    targets = {manufacturer: (f".kicad_helpers_config/manufacturers/{ manufacturer }.yaml", ".")
+               for manufacturer in manufacturers}
+    merged, owners = merge_kibot_configs(targets, project)
+
+    plots = {}
+    outputs = []
+    derived = {manufacturer: [] for manufacturer in manufacturers}
+    for out in merged.get("outputs") or []:
+        if out["type"] == "compress":
+            raise RuntimeError(f"Output { out['name'] } of { owners[out['name']] } is a compress output, "
+                               "which can't be shared between manufacturers; use --zip instead.")
+        key = json.dumps({name: value for name, value in out.items() if name not in _shared_output_keys},
+                         sort_keys=True)
+        if key not in plots:
+            plots[key] = out["name"]
+            outputs.append({**out, "dir": out["name"]})
+        derived[owners[out["name"]]].append((plots[key], out["dir"]))
+    merged["outputs"] = outputs
+    return merged, derived
+
+def _derive_outputs(shared_path, output_path, plots, zip_outputs=False):
+    """Copy the files of each shared output in `plots` (see
+    `plan_manufacturing`) from `shared_path` to `output_path`, and package
+    them in `output_path.zip` if `zip_outputs` is `True`.
+    """
+    with trace_span("derive outputs", "io", path=output_path):
+        for plot, dir_ in plots:
+            for file in _output_files(os.path.join(shared_path, plot)):
+                dst_path = os.path.join(output_path, dir_, file)
+                os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                shutil.copyfile(os.path.join(shared_path, plot, file), dst_path)
+        if zip_outputs:
+            shutil.make_archive(output_path, "zip", output_path)
+
+def export_all_manufacturers(root=".", output=".", manufacturers=None, v=False, cache=True, zip_outputs=False):
+    """Export the manufacturing files for each of `manufacturers` (all of
+    them by default) to `output/MANUFACTURER`, running KiBot once to plot the
+    outputs shared by several manufacturers (see `plan_manufacturing`) and
+    then deriving each manufacturer's files from them in parallel.
+    """
+    project = get_project(root)
+    if os.path.abspath(output) == output:
+        raise RuntimeError(f"OUTPUT cannot be an absolute path; it must be relative to ROOT={ project.root }.")
+    if not (project.manufacturers if manufacturers is None else manufacturers):
+        raise RuntimeError("There are no manufacturers to export; add a KiBot config for each one to "
+                           f"{ os.path.join(project.root, '.kicad_helpers_config', 'manufacturers') }.")
+    config, derived = plan_manufacturing(project, manufacturers)
+    if v:
+        n_outputs = sum(len(plots) for plots in derived.values())
+        print(f"Plot { len(config['outputs']) } outputs for { n_outputs } manufacturer outputs.")
+
+    # The shared outputs are written next to their config (in the project
+    # directory, i.e., the docker workdir), which is named after its content
+    # so they can be restored from the output cache
+    content = yaml.safe_dump(config, sort_keys=False)
+    shared = ".kh_export_man-" + hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+    shared_path = os.path.join(project.root, shared)
+    try:
+        os.makedirs(shared_path, exist_ok=True)
+        with open(os.path.join(shared_path, "config.yaml"), "w") as f:
+            f.write(content)
+        run_kibot_docker(config=posixpath.join(shared, "config.yaml"), root=project, v=v, output=shared, cache=cache)
+        with ThreadPoolExecutor(max_workers=len(derived)) as executor:
+            jobs = [executor.submit(_derive_outputs, shared_path, os.path.join(project.root, output, manufacturer),
+                                    plots, zip_outputs)
+                    for manufacturer, plots in derived.items()]
+            for job in jobs:
+                job.result()
+    finally:
+        shutil.rmtree(shared_path, ignore_errors=True)
\ No newline at end of file
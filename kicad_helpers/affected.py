@@ -0,0 +1,119 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: notebooks/09_affected.ipynb (unless otherwise specified).
+
+__all__ = ['get_input_actions', 'get_changed_paths', 'find_affected', 'affected']
+
+# Cell
+import os
+import posixpath
+import re
+
+from fastcore.script import *
+
+from kicad_helpers import *
+from .utilities import _get_git_repo, _input_patterns, _set_root
+
+# Cell
+_kicad_actions = ["run_erc", "run_drc", "export_manufacturing", "export_sch", "export_pcb", "build_project"]
+_affected_actions = ["sch_to_bom", "bom_to_sch"] + _kicad_actions
+
+_config_actions = [(r"erc\.yaml", ["run_erc"]),
+                   (r"drc\.yaml", ["run_drc"]),
+                   (r"manufacturers/[^/]+\.yaml", ["export_manufacturing"]),
+                   (r"sch_\w+\.yaml", ["export_sch"]),
+                   (r"pcb_\w+\.yaml", ["export_pcb"])]
+
+# The actions that each kind of input (see `_input_patterns`) is read by
+_input_actions = {"schematic": ["run_erc", "sch_to_bom", "export_sch"],
+                  "board": ["run_drc", "export_manufacturing", "export_pcb"],
+                  "project": _kicad_actions}
+
+def get_input_actions(name, path):
+    """Get the kind of input ("schematic", "board", "bom", "project" or
+    "config") that `path` (relative to the root of the project called
+    `name`, with "/" separators) is, and the list of actions it's an input
+    of. Returns `(None, [])` for other files.
+    """
+    if path == f"manufacturing/default/{ name }-BOM.csv":
+        return "bom", ["sch_to_bom", "bom_to_sch"]
+    if path.startswith(".kicad_helpers_config/"):
+        config = path[len(".kicad_helpers_config/"):]
+        actions = next((actions for pattern, actions in _config_actions if re.fullmatch(pattern, config)),
+                       _kicad_actions)
+        return "config", [action for action in _affected_actions if action in actions or action == "build_project"]
+    for kind, pattern in _input_patterns:
+        if re.fullmatch(pattern, path):
+            return kind, [action for action in _affected_actions
+                          if action in _input_actions[kind] or action == "build_project"]
+    return None, []
+
+# Cell
+def get_changed_paths(since="HEAD", root=".", repo=None):
+    """Get the paths (relative to the root of the git repository containing
+    `root`, with "/" separators) of the files that differ between the
+    commit `since` and the working tree, including untracked files.
+    """
+    if repo is None:
+        repo = _get_git_repo(_set_root(root))
+    # NUL-terminated paths aren't quoted (e.g., if they aren't ASCII)
+    paths = repo.git.diff("--name-only", "--no-renames", "-z", since, "--").split("\0")
+    paths += repo.git.ls_files("--others", "--exclude-standard", "-z").split("\0")
+    return sorted(set(path for path in paths if path))
+
+def find_affected(since="HEAD", root="."):
+    """Find the KiCad projects in the git repository containing `root` that
+    are affected by the changes since the commit `since` (see
+    `get_changed_paths`).
+
+    Returns a dictionary mapping the root directory of each affected project
+    to a dictionary mapping each affected action to the list of changed
+    paths (relative to the project root) that are inputs of the action.
+    """
+    repo = _get_git_repo(_set_root(root))
+    git_root = os.path.realpath(repo.working_tree_dir)
+
+    # Map each project directory to its name (nested projects come first, so
+    # that files are assigned to the closest project)
+    projects = {}
+    for path in repo.git.ls_files("--cached", "--others", "--exclude-standard", "-z", "--", "*.pro").split("\0"):
+        if not path:
+            continue
+        projects[posixpath.dirname(path)] = posixpath.splitext(posixpath.basename(path))[0]
+    project_dirs = sorted(projects, key=len, reverse=True)
+
+    affected = {}
+    for path in get_changed_paths(since, repo=repo):
+        project_dir = next((d for d in project_dirs if d == "" or path.startswith(d + "/")), None)
+        if project_dir is None:
+            continue
+        relpath = path[len(project_dir) + 1:] if project_dir else path
+        kind, actions = get_input_actions(projects[project_dir], relpath)
+        if actions:
+            project_root = os.path.normpath(os.path.join(git_root, project_dir))
+            for action in actions:
+                affected.setdefault(project_root, {}).setdefault(action, []).append(relpath)
+    return {project_root: {action: actions[action] for action in _affected_actions if action in actions}
+            for project_root, actions in sorted(affected.items())}
+
+# Cell
+@profiled
+@call_parse
+def affected(since:Param("git commit (e.g., a branch or tag) to compare the working tree with", str)="HEAD",
+             root:Param("directory in the git repository", str)=".",
+             action:Param(f"only list the projects affected for this action ({ ', '.join(_affected_actions) })",
+                          str)=None,
+             v:Param("verbose", bool)=False):
+    """List the KiCad projects (and the actions to run on each) whose inputs
+    have changed since the git commit SINCE.
+    """
+    if action is not None and action not in _affected_actions:
+        raise RuntimeError(f"ACTION must be one of the following: { ', '.join(_affected_actions) }.")
+    for project_root, actions in find_affected(since, root).items():
+        path = os.path.relpath(project_root)
+        if action is not None:
+            if action in actions:
+                print(path)
+            continue
+        print(f"{ path }: { ', '.join(actions) }")
+        if v:
+            for name, paths in actions.items():
+                print(f"    { name }: { ', '.join(paths) }")
\ No newline at end of file
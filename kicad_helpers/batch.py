@@ -0,0 +1,130 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: notebooks/03_batch.ipynb (unless otherwise specified).
+
+__all__ = ['find_projects', 'run_batch', 'batch']
+
+# Cell
+import contextlib
+import io
+import multiprocessing
+import os
+import shlex
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from fastcore.script import *
+from fastcore.utils import num_cpus
+
+from kicad_helpers import *
+from kicad_helpers import actions, utilities
+from .affected import find_affected
+from .utilities import _set_root
+
+# Cell
+def find_projects(path="."):
+    """Find the root directory of every KiCad project (i.e., each directory
+    containing a `*.pro` file) under `path`, skipping hidden directories.
+    """
+    path = _set_root(path)
+    roots = []
+    for root_, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        if any(f.endswith(".pro") for f in files):
+            roots.append(root_)
+    return roots
+
+# Cell
+_batch_actions = ["sch_to_bom", "bom_to_sch", "set_date", "set_revision", "run_erc", "run_drc",
+                  "export_manufacturing", "export_sch", "export_pcb", "build_project"]
+
+def _parse_action_args(action, args=""):
+    """Parse the command line arguments `args` for `action` (the name of a
+    function in `kicad_helpers.actions`) into a dictionary of keyword
+    arguments.
+    """
+    if action not in _batch_actions:
+        raise RuntimeError(f"ACTION must be one of the following: { ', '.join(_batch_actions) }.")
+    func = getattr(actions, action).__wrapped__
+    kwargs = vars(anno_parser(func, prog=action).parse_args(shlex.split(args or "")))
+    for key in ["pdb", "xtra", "root"]:
+        kwargs.pop(key, None)
+    return kwargs
+
+def _init_worker(docker_slots):
+    utilities._docker_slots = docker_slots
+
+def _run_action(action, root, kwargs):
+    """Run `action` on the project in `root`, capturing its output. Returns a
+    dictionary with the project `root`, the `returncode` (0 if the action
+    succeeded), the `output` and the number of `seconds` it took.
+    """
+    start = time.time()
+    output = io.StringIO()
+    returncode = 0
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            getattr(actions, action).__wrapped__(root=root, **kwargs)
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            traceback.print_exc()
+            returncode = 1
+    return {"root": root, "returncode": returncode,
+            "output": output.getvalue(), "seconds": time.time() - start}
+
+# Cell
+def run_batch(action, roots, args="", n_workers=None, docker_jobs=2):
+    """Run `action` (with the command line arguments `args`) on each of the
+    project `roots` in a pool of `n_workers` processes, with at most
+    `docker_jobs` docker commands running at once. Returns a list of results
+    (see `_run_action`), in the same order as `roots`.
+    """
+    kwargs = _parse_action_args(action, args)
+    if n_workers is None:
+        n_workers = num_cpus()
+    n_workers = max(1, min(n_workers, len(roots)))
+    docker_slots = multiprocessing.BoundedSemaphore(max(1, docker_jobs))
+    results = {}
+    with ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(docker_slots,)) as pool:
+        futures = [pool.submit(_run_action, action, root, kwargs) for root in roots]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["root"]] = result
+    return [results[root] for root in roots]
+
+# Cell
+@profiled
+@call_parse
+def batch(action:Param(f"action to run on each project ({ ', '.join(_batch_actions) })", str),
+          args:Param("arguments for the action (e.g., --args=\"--ext svg\")", str)="",
+          path:Param("directory to search for projects", str)=".",
+          n_workers:Param("number of worker processes (defaults to the number of CPUs)", int)=None,
+          docker_jobs:Param("maximum number of concurrent docker commands", int)=2,
+          since:Param("only run on the projects affected by the changes since this git commit", str)=None,
+          v:Param("verbose", bool)=False):
+    """Run an action on every KiCad project (i.e., each directory containing a
+    `*.pro` file) under PATH and print a report. The exit code is non-zero if
+    the action failed on any project.
+    """
+    path = _set_root(path)
+    roots = find_projects(path)
+    if len(roots) == 0:
+        raise RuntimeError(f"No KiCad projects found in { path }.")
+    if since is not None:
+        affected = find_affected(since, path)
+        roots = [root for root in roots if action in affected.get(os.path.realpath(root), {})]
+        if len(roots) == 0:
+            print(f"No projects are affected for { action } since { since }.")
+            return
+
+    results = run_batch(action, roots, args=args, n_workers=n_workers, docker_jobs=docker_jobs)
+    for result in results:
+        status = "ok" if result["returncode"] == 0 else "FAILED"
+        print(f"{ status :6s} { result['seconds'] :8.1f}s  { os.path.relpath(result['root'], path) }")
+        if result["output"] and (v or result["returncode"] != 0):
+            print("\n".join("    " + line for line in result["output"].splitlines()))
+    failed = sum(result["returncode"] != 0 for result in results)
+    print(f"{ len(results) - failed } succeeded, { failed } failed")
+    if failed:
+        sys.exit(1)
\ No newline at end of file
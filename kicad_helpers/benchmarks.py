@@ -0,0 +1,220 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: notebooks/07_benchmarks.ipynb (unless otherwise specified).
+
+__all__ = ['make_synthetic_project', 'run_benchmarks', 'compare_benchmarks', 'benchmarks']
+
+# Cell
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fastcore.script import *
+
+import kicad_helpers
+from kicad_helpers import *
+from kicad_helpers import utilities
+from .actions import sch_to_bom
+from .test import validate_bom
+
+# Cell
+_synthetic_parts = [
+    ("R", "Device:R", "10k", "Resistor_SMD:R_0603_1608Metric", "RC0603FR-0710KL", "Yageo"),
+    ("R", "Device:R", "1k", "Resistor_SMD:R_0603_1608Metric", "RC0603FR-071KL", "Yageo"),
+    ("C", "Device:C", "100n", "Capacitor_SMD:C_0603_1608Metric", "CL10B104KB8NNNC", "Samsung"),
+    ("C", "Device:C", "10u", "Capacitor_SMD:C_0805_2012Metric", "CL21A106KAYNNNE", "Samsung"),
+    ("U", "Timer:NE555P", "NE555P", "Package_DIP:DIP-8_W7.62mm", "NE555P", "Texas Instruments"),
+]
+
+_synthetic_title_block = """Sheet {sheet} {n_sheets}
+Title "Synthetic board"
+Date "2021-01-01"
+Rev "1.0"
+Comp "kicad-helpers"
+Comment1 ""
+Comment2 ""
+Comment3 ""
+Comment4 ""
+"""
+
+def _synthetic_sheet(body, sheet, n_sheets):
+    return ("EESchema Schematic File Version 4\nEELAYER 30 0\nEELAYER END\n$Descr A4 11693 8268\n"
+            "encoding utf-8\n" + _synthetic_title_block.format(sheet=sheet, n_sheets=n_sheets)
+            + "$EndDescr\n" + body + "$EndSCHEMATC\n")
+
+def _synthetic_component(i, ref, part):
+    prefix, lib_id, value, footprint, mpn, manufacturer = part
+    x, y = 1000 + 100 * (i % 100), 1000 + 100 * (i // 100 % 70)
+    return (f"$Comp\nL {lib_id} {ref}\nU 1 1 { i + 1 :08X}\nP {x} {y}\n"
+            f'F 0 "{ref}" H {x} {y} 50  0000 L CNN\nF 1 "{value}" H {x} {y} 50  0000 L CNN\n'
+            f'F 2 "{footprint}" V {x} {y} 50  0001 C CNN\nF 3 "~" H {x} {y} 50  0001 C CNN\n'
+            f'F 4 "{mpn}" H {x} {y} 50  0001 C CNN "MPN"\n'
+            f'F 5 "{manufacturer}" H {x} {y} 50  0001 C CNN "Manufacturer"\n'
+            f"\t1    {x} {y}\n\t1    0    0    -1  \n$EndComp\n")
+
+_synthetic_footprint = """  (module {footprint} (layer F.Cu) (tedit 5B301BBD) (tstamp {i:08X})
+    (at {x} {y})
+    (descr "Synthetic footprint")
+    (fp_text reference {ref} (at 0 -1.43) (layer F.SilkS)
+      (effects (font (size 1 1) (thickness 0.15)))
+    )
+    (fp_text value {value} (at 0 1.43) (layer F.Fab)
+      (effects (font (size 1 1) (thickness 0.15)))
+    )
+    (pad 1 smd roundrect (at -0.7875 0) (size 0.875 0.95) (layers F.Cu F.Paste F.Mask) (roundrect_rratio 0.25))
+    (pad 2 smd roundrect (at 0.7875 0) (size 0.875 0.95) (layers F.Cu F.Paste F.Mask) (roundrect_rratio 0.25))
+  )
+"""
+
+def make_synthetic_project(root, name="synthetic", n_sheets=4, n_components=1000, board_mb=5, git=True):
+    """Write a synthetic KiCad project named `name` to `root` (see above),
+    with a BOM and (if `git`) a git repository. Returns `root`.
+    """
+    os.makedirs(root, exist_ok=True)
+    n_sheets = max(1, n_sheets)
+    with open(os.path.join(root, name + ".pro"), "w") as f:
+        f.write("update=01/01/2021 00:00:00\nversion=1\nlast_client=kicad\n")
+    with open(os.path.join(root, "kitspace.yaml"), "w") as f:
+        f.write("summary: A synthetic project for benchmarks\nsite: https://example.com\ncolor: black\n")
+
+    sheets = ""
+    for i in range(n_sheets):
+        sheets += (f"$Sheet\nS { 1000 + 2000 * i } 1000 1500 1000\nU { 0x5D000000 + i :08X}\n"
+                   f'F0 "sheet_{i}" 50\nF1 "sheet_{i}.sch" 50\n$EndSheet\n')
+    with open(os.path.join(root, name + ".sch"), "w") as f:
+        f.write(_synthetic_sheet(sheets, 1, n_sheets + 1))
+
+    # Spread the components across the sub-sheets and the footprints across the board
+    refs = []
+    bodies = [[] for i in range(n_sheets)]
+    counts = {}
+    for i in range(n_components):
+        part = _synthetic_parts[i % len(_synthetic_parts)]
+        counts[part[0]] = counts.get(part[0], 0) + 1
+        refs.append((f"{ part[0] }{ counts[part[0]] }", part))
+        bodies[i % n_sheets].append(_synthetic_component(i, *refs[-1]))
+    for i, body in enumerate(bodies):
+        with open(os.path.join(root, f"sheet_{i}.sch"), "w") as f:
+            f.write(_synthetic_sheet("".join(body), i + 2, n_sheets + 1))
+
+    with open(os.path.join(root, name + ".kicad_pcb"), "w") as f:
+        f.write("(kicad_pcb (version 20171130) (host pcbnew 5.1.9)\n\n  (general\n    (thickness 1.6)\n  )\n\n"
+                "  (page A4)\n  (title_block\n    (title \"Synthetic board\")\n    (date 2021-01-01)\n"
+                "    (rev 1.0)\n    (company kicad-helpers)\n  )\n\n"
+                "  (layers\n    (0 F.Cu signal)\n    (31 B.Cu signal)\n  )\n\n")
+        i = 0
+        while f.tell() < board_mb * 1e6 or i < len(refs):
+            ref, part = refs[i] if i < len(refs) else (f"X{i}", _synthetic_parts[0])
+            f.write(_synthetic_footprint.format(footprint=part[3], i=i, x=i % 300, y=i // 300, ref=ref, value=part[2]))
+            i += 1
+        f.write(")\n")
+
+    sch_to_bom.__wrapped__(root=root)
+    if git:
+        subprocess.run("git init -q . && git add -A && git -c user.name=kh -c user.email=kh@example.com commit -qm init",
+                       shell=True, cwd=root, check=True)
+    return root
+
+# Cell
+def _clear_caches():
+    utilities._projects.clear()
+    utilities._git_roots.clear()
+    utilities._schematics.clear()
+
+_benchmarks = {
+    "get_project (cold)": (_clear_caches, lambda root, i: get_project(root)),
+    "get_project": (None, lambda root, i: get_project(root)),
+    "get_git_root": (None, lambda root, i: get_git_root(root)),
+    "get_schematic_hierarchy (cold)": (_clear_caches, lambda root, i: get_schematic_hierarchy(root)),
+    "get_board_metadata": (None, lambda root, i: get_board_metadata(root)),
+    "update_board_metadata": (None, lambda root, i: update_board_metadata({"rev": f"{ i % 2 }.0"}, root=root)),
+    "update_schematic_metadata": (None, lambda root, i: update_schematic_metadata({"Rev": f"{ i % 2 }.0"}, root=root)),
+    "sch_to_bom": (None, lambda root, i: sch_to_bom.__wrapped__(root=root)),
+    "validate_bom": (None, lambda root, i: validate_bom(root)),
+}
+
+def run_benchmarks(root, names=None, repeat=5):
+    """Run the benchmarks in `names` (all by default) on the project in
+    `root`. Returns a dictionary mapping each name to the `min`, `median` and
+    `mean` time (in seconds) of `repeat` runs.
+    """
+    root = os.path.abspath(root)
+    results = {}
+    for name in names or _benchmarks:
+        setup, func = _benchmarks[name]
+        times = []
+        for i in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func(root, i)
+            times.append(time.perf_counter() - start)
+        results[name] = {"min": min(times), "median": statistics.median(times), "mean": statistics.mean(times),
+                         "repeat": repeat}
+    return results
+
+# Cell
+def _commit():
+    """Get the git commit of the `kicad_helpers` source (or `None`)."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(kicad_helpers.__file__)).decode("utf-8").strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+def compare_benchmarks(baseline, results, threshold=1.2):
+    """Compare benchmark `results` to a `baseline` (both as returned by
+    `benchmarks`). Returns a list of `(name, baseline_median, median, ratio,
+    regression)` tuples, where `regression` is `True` if the median time grew
+    by more than `threshold` times.
+    """
+    rows = []
+    for name, result in results["results"].items():
+        if name in baseline["results"]:
+            old, new = baseline["results"][name]["median"], result["median"]
+            ratio = new / old if old > 0 else float("inf")
+            rows.append((name, old, new, ratio, ratio > threshold))
+    return rows
+
+# Cell
+@profiled
+@call_parse
+def benchmarks(sheets:Param("number of sub-sheets in the synthetic project", int)=4,
+               components:Param("number of components in the synthetic project", int)=1000,
+               board_mb:Param("approximate size of the synthetic board file (in MB)", float)=5,
+               repeat:Param("number of runs of each benchmark", int)=5,
+               output:Param("write the results to this JSON file", str)=None,
+               baseline:Param("compare to the results in this JSON file", str)=None,
+               threshold:Param("report a regression if a median time grows by more than this factor", float)=1.2):
+    """Time common operations on a synthetic project and print the results
+    (or write them to OUTPUT as JSON, which can be compared with the results
+    from another commit using --baseline). The exit code is non-zero if
+    there's a regression compared to the baseline.
+    """
+    params = {"sheets": sheets, "components": components, "board_mb": board_mb}
+    with tempfile.TemporaryDirectory() as tmp:
+        root = make_synthetic_project(os.path.join(tmp, "synthetic"), n_sheets=sheets, n_components=components,
+                                      board_mb=board_mb)
+        results = {"kicad_helpers": kicad_helpers.__version__, "commit": _commit(),
+                   "python": platform.python_version(), "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                   "params": params, "results": run_benchmarks(root, repeat=repeat)}
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+    for name, result in results["results"].items():
+        print(f"{ result['median'] * 1000 :10.1f} ms  { name }")
+    if baseline is not None:
+        with open(baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("params") != params:
+            print(f"Warning: the baseline was run with different parameters ({ baseline.get('params') })")
+        rows = compare_benchmarks(baseline, results, threshold=threshold)
+        print()
+        for name, old, new, ratio, regression in rows:
+            print(f"{ ratio :6.2f}x  { old * 1000 :10.1f} -> { new * 1000 :10.1f} ms  { name }"
+                  + ("  REGRESSION" if regression else ""))
+        if any(row[-1] for row in rows):
+            sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,98 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: notebooks/04_cli.ipynb (unless otherwise specified).
+
+__all__ = ['benchmark_startup', 'main']
+
+# Cell
+import argparse
+import importlib
+import os
+import subprocess
+import sys
+import time
+
+# Cell
+_commands = {
+    "update": ("kicad_helpers.actions", "update_project"),
+    "sch_to_bom": ("kicad_helpers.actions", "sch_to_bom"),
+    "bom_to_sch": ("kicad_helpers.actions", "bom_to_sch"),
+    "export_man": ("kicad_helpers.actions", "export_manufacturing"),
+    "export_sch": ("kicad_helpers.actions", "export_sch"),
+    "export_pcb": ("kicad_helpers.actions", "export_pcb"),
+    "run_erc": ("kicad_helpers.actions", "run_erc"),
+    "run_drc": ("kicad_helpers.actions", "run_drc"),
+    "set_date": ("kicad_helpers.actions", "set_date"),
+    "set_revision": ("kicad_helpers.actions", "set_revision"),
+    "add_badges": ("kicad_helpers.actions", "add_badges"),
+    "build": ("kicad_helpers.actions", "build_project"),
+    "batch": ("kicad_helpers.batch", "batch"),
+    "daemon": ("kicad_helpers.daemon", "daemon"),
+    "daemon_client": ("kicad_helpers.daemon", "daemon_client"),
+    "benchmarks": ("kicad_helpers.benchmarks", "benchmarks"),
+    "git_filter": ("kicad_helpers.gitfilter", "git_filter_process"),
+    "affected": ("kicad_helpers.affected", "affected"),
+    "test": ("kicad_helpers.test", "test_notebooks"),
+    "setup_test_repo": ("kicad_helpers.utilities", "setup_test_repo"),
+    "docker_stop": ("kicad_helpers.utilities", "stop_docker_containers"),
+}
+
+def _usage():
+    return ("usage: kh [-h] COMMAND [ARGS]\n\n"
+            "Run `kh COMMAND --help` for the arguments of each command.\n\n"
+            "commands:\n" + "\n".join(f"  { name }" for name in list(_commands) + ["benchmark"]))
+
+# Cell
+def benchmark_startup(commands=None, repeat=3):
+    """Measure the time taken to run `kh COMMAND --help` (i.e., to start the
+    interpreter, import the command and build its argument parser) for each
+    of `commands` (all commands by default) in a new process. Returns a
+    dictionary mapping each command to the best of `repeat` times (in
+    seconds), including a "python" entry for an empty interpreter.
+    """
+    if commands is None:
+        commands = list(_commands)
+    runs = {"python": [sys.executable, "-c", "pass"]}
+    for name in commands:
+        runs[name] = [sys.executable, "-c", "from kicad_helpers.cli import main; main()", name, "--help"]
+    times = {}
+    for name, cmd in runs.items():
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times[name] = best
+    return times
+
+def _benchmark(argv):
+    parser = argparse.ArgumentParser(prog="kh benchmark", description=benchmark_startup.__doc__.split("\n\n")[0])
+    parser.add_argument("commands", nargs="*", help="commands to benchmark (defaults to all)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each command")
+    args = parser.parse_args(argv)
+    for name in args.commands:
+        if name not in _commands:
+            parser.error(f"unknown command: { name }")
+    times = benchmark_startup(args.commands or None, repeat=args.repeat)
+    for name, seconds in times.items():
+        print(f"{ seconds * 1000 :8.0f} ms  { name }")
+
+# Cell
+def main(argv=None):
+    """Run `kh COMMAND [ARGS]`."""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if len(argv) == 0 or argv[0] in ("-h", "--help"):
+        print(_usage())
+        return
+    name, args = argv[0], argv[1:]
+    if name == "benchmark":
+        return _benchmark(args)
+    if name not in _commands:
+        print(_usage(), file=sys.stderr)
+        sys.exit(f"kh: error: unknown command: { name }")
+
+    module, func = _commands[name]
+    func = getattr(importlib.import_module(module), func)
+    # Scripts defined with `call_parse` parse their arguments from `sys.argv`
+    # when run by their console script entry point (see `profiled`)
+    sys.argv = [f"kh { name }"] + args
+    return getattr(func, "main", func)()
\ No newline at end of file
@@ -0,0 +1,265 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: notebooks/05_daemon.ipynb (unless otherwise specified).
+
+__all__ = ['check_project', 'ProjectDaemon', 'serve_daemon', 'daemon_request', 'daemon', 'daemon_client']
+
+# Cell
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from fastcore.script import *
+
+from kicad_helpers import *
+from .actions import extract_bom
+from .utilities import _cache_dir, _set_root, _stamp
+
+# Cell
+def _daemon_socket_path(root="."):
+    """Path of the Unix socket used by the daemon for the project in `root`.
+    """
+    root = _set_root(root)
+    return os.path.join(_cache_dir(), "daemon", hashlib.sha1(root.encode()).hexdigest()[:12] + ".sock")
+
+# Cell
+def check_project(root="."):
+    """Run quick checks that don't need KiCad (unannotated components and
+    mismatched schematic/board metadata). Returns a list of problems.
+    """
+    project = get_project(root)
+    problems = []
+    for schematic in get_schematic_hierarchy(project):
+        for component in schematic.components:
+            refs = sorted(ref for ref in component.refs if ref.endswith("?") and not ref.startswith("#"))
+            for ref in refs:
+                problems.append(f"{ os.path.relpath(schematic.path, project.root) }: { ref } is not annotated")
+
+    if os.path.exists(project.board_path):
+        sch_metadata = get_schematic_metadata(project.root)
+        board_metadata = get_board_metadata(project)
+        for sch_key, board_key in [("Title", "title"), ("Date", "date"), ("Rev", "rev"), ("Comp", "company")]:
+            sch_value = sch_metadata[sch_key].strip('"')
+            board_value = board_metadata.get(board_key, "").strip('"')
+            if sch_value != board_value:
+                problems.append(f"{ sch_key } differs between the schematic ({ sch_value !r}) "
+                                f"and the board ({ board_value !r})")
+    return problems
+
+# Cell
+class ProjectDaemon:
+    """Keeps the project in `root` loaded, polling its files every `interval`
+    seconds. When the schematic hierarchy changes, the BOM is regenerated;
+    when only the BOM file changes (e.g., it was edited before running
+    `bom_to_sch`), it is reloaded without being rewritten. After any change,
+    the checks (see `check_project`) are re-run.
+    """
+    def __init__(self, root=".", interval=1.0, v=False):
+        self.project = get_project(root)
+        self.interval, self.v = interval, v
+        self.lock = threading.RLock()
+        self.stamps = {}
+        self.bom = None
+        self.problems = []
+        self.updated = None
+        self._stopped = threading.Event()
+        self.refresh()
+
+    def _log(self, message):
+        if self.v:
+            print(f"[{ time.strftime('%H:%M:%S') }] { message }", flush=True)
+
+    def _watched(self):
+        paths = [schematic.path for schematic in get_schematic_hierarchy(self.project)]
+        return paths + [self.project.board_path, self.project.bom_path,
+                        os.path.join(self.project.root, "kitspace.yaml")]
+
+    def changed(self):
+        """Get a list of the watched files that changed since the last refresh.
+        """
+        return [path for path in self._watched() if self.stamps.get(path) != _stamp(path)]
+
+    def refresh(self, changed=None):
+        """Regenerate the BOM (if any of the `changed` files is a schematic),
+        or reload it (if only the BOM file changed), and re-run the checks.
+        If `changed` is `None`, everything is updated.
+        """
+        with self.lock:
+            if (changed is None or any(path.endswith(".sch") for path in changed)
+                    or not os.path.exists(self.project.bom_path)):
+                self._update_bom()
+            elif self.project.bom_path in changed:
+                self._load_bom()
+            self.problems = check_project(self.project)
+            self.stamps = {path: _stamp(path) for path in self._watched()}
+            self.updated = time.time()
+            for problem in self.problems:
+                self._log(problem)
+
+    def _update_bom(self):
+        bom = extract_bom(self.project)
+        csv = bom.to_csv(index=False)
+        try:
+            with open(self.project.bom_path, newline="") as f:
+                existing = f.read()
+        except FileNotFoundError:
+            existing = None
+        if csv != existing:
+            os.makedirs(os.path.dirname(self.project.bom_path), exist_ok=True)
+            with open(self.project.bom_path, "w", newline="") as f:
+                f.write(csv)
+            self._log(f"Wrote { bom['Quantity'].sum() } parts ({ len(bom) } lines) to { self.project.bom_path }")
+        self.bom = bom
+
+    def _load_bom(self):
+        import pandas as pd
+
+        self.bom = pd.read_csv(self.project.bom_path, dtype=str, keep_default_na=False)
+        self._log(f"Reloaded { len(self.bom) } lines from { self.project.bom_path }")
+
+    def poll(self):
+        """Refresh if any watched file changed. Returns the changed files.
+        """
+        with self.lock:
+            changed = self.changed()
+            if changed:
+                self._log("Changed: " + ", ".join(os.path.relpath(path, self.project.root) for path in changed))
+                self.refresh(changed)
+            return changed
+
+    def watch(self):
+        """Poll for changes until `stop` is called.
+        """
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                # e.g., a file that's being written by KiCad; try again on the next poll
+                self._log(f"Refresh failed: { e !r}")
+
+    def stop(self):
+        self._stopped.set()
+
+    def handle(self, request):
+        """Handle a request (a dictionary with a "cmd" key) from a client and
+        return the response.
+        """
+        cmd = request.get("cmd")
+        with self.lock:
+            self.poll()
+            if cmd == "status":
+                return {"ok": True, "root": self.project.root, "name": self.project.name,
+                        "updated": self.updated, "files": len(self.stamps)}
+            elif cmd == "bom":
+                return {"ok": True, "csv": self.bom.to_csv(index=False)}
+            elif cmd == "metadata":
+                return {"ok": True, "project": get_project_metadata(self.project),
+                        "schematic": get_schematic_metadata(self.project.root),
+                        "board": get_board_metadata(self.project)}
+            elif cmd == "check":
+                return {"ok": True, "problems": self.problems}
+            elif cmd == "refresh":
+                self.refresh()
+                return {"ok": True, "problems": self.problems}
+            elif cmd == "stop":
+                self.stop()
+                return {"ok": True}
+        return {"ok": False, "error": f"Unknown command { cmd !r}."}
+
+# Cell
+class _DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.daemon.handle(json.loads(line))
+            except Exception as e:
+                response = {"ok": False, "error": f"{ type(e).__name__ }: { e }"}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            if self.server.daemon._stopped.is_set():
+                threading.Thread(target=self.server.shutdown).start()
+                break
+
+def serve_daemon(root=".", interval=1.0, v=False, socket_path=None):
+    """Run a `ProjectDaemon` for the project in `root`, serving requests on
+    a Unix socket (see `daemon_request`) until a "stop" request is received.
+    """
+    if socket_path is None:
+        socket_path = _daemon_socket_path(root)
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        try:
+            daemon_request("status", socket_path=socket_path)
+        except RuntimeError:
+            os.remove(socket_path)  # stale socket from a daemon that didn't exit cleanly
+        else:
+            raise RuntimeError(f"A daemon is already running for { _set_root(root) }.")
+
+    project_daemon = ProjectDaemon(root, interval=interval, v=v)
+    watcher = threading.Thread(target=project_daemon.watch, daemon=True)
+    with socketserver.ThreadingUnixStreamServer(socket_path, _DaemonRequestHandler) as server:
+        server.daemon = project_daemon
+        server.daemon_threads = True
+        watcher.start()
+        project_daemon._log(f"Serving { project_daemon.project.root } on { socket_path }")
+        try:
+            server.serve_forever()
+        finally:
+            project_daemon.stop()
+            os.remove(socket_path)
+    watcher.join()
+
+# Cell
+def daemon_request(cmd, root=".", socket_path=None, timeout=60):
+    """Send a request to the daemon serving the project in `root` and return
+    its response (a dictionary).
+    """
+    if socket_path is None:
+        socket_path = _daemon_socket_path(root)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        try:
+            s.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise RuntimeError(f"No daemon is running for { _set_root(root) }; start one with `kh daemon`.")
+        s.sendall(json.dumps({"cmd": cmd}).encode() + b"\n")
+        with s.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise RuntimeError("The daemon closed the connection.")
+    response = json.loads(line)
+    if not response.pop("ok"):
+        raise RuntimeError(response["error"])
+    return response
+
+# Cell
+@profiled
+@call_parse
+def daemon(root:Param("project root directory", str)=".",
+           interval:Param("seconds between checks for changed files", float)=1.0,
+           v:Param("verbose", bool)=False):
+    """Watch the project for changes, regenerating the BOM when the schematic
+    changes, and serve requests from `kh daemon_client` until stopped.
+    """
+    serve_daemon(root, interval=interval, v=v)
+
+# Cell
+@profiled
+@call_parse
+def daemon_client(cmd:Param("request to send (status, bom, metadata, check, refresh or stop)", str),
+            root:Param("project root directory", str)="."):
+    """Send a request to the daemon for the project and print the response.
+    The exit code is non-zero if the checks found any problems.
+    """
+    response = daemon_request(cmd, root)
+    if cmd == "bom":
+        print(response["csv"], end="")
+    elif cmd in ("check", "refresh"):
+        for problem in response["problems"]:
+            print(problem)
+        if response["problems"]:
+            sys.exit(1)
+    elif cmd != "stop":
+        print(json.dumps(response, indent=2))
\ No newline at end of file
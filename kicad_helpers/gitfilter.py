@@ -0,0 +1,136 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: notebooks/08_gitfilter.ipynb (unless otherwise specified).
+
+__all__ = ['clean_pro', 'filter_sch', 'filter_content', 'git_filter_process']
+
+# Cell
+import re
+import sys
+import zlib
+
+# Cell
+_pro_update = re.compile(r"^update=[^\r\n]*", re.MULTILINE)
+
+def clean_pro(text):
+    """Normalize the contents of a `*.pro` file."""
+    return _pro_update.sub("update=Date", text)
+
+# Cell
+_sch_power_ref = r"#(?:PWR|FLG)(?:\d+|\?)"
+_sch_ref_lines = [re.compile(rf"^(L \S+ )({ _sch_power_ref })()(?=\s)"),
+                  re.compile(rf'^(F 0 ")({ _sch_power_ref })(")'),
+                  re.compile(rf'^(AR Path="([^"]*)" Ref=")({ _sch_power_ref })(")')]
+
+def _power_ref(ref, key, smudge):
+    prefix = ref[:4]
+    return f"{ prefix }{ zlib.crc32(key.encode('utf-8')) }" if smudge else f"{ prefix }?"
+
+def _filter_sch_component(lines, smudge):
+    timestamp = next((line.split()[3] for line in lines if line.startswith("U ") and len(line.split()) > 3), "")
+    result = []
+    for line in lines:
+        if line.startswith(("L ", "F 0 ")):
+            pattern = _sch_ref_lines[0] if line.startswith("L ") else _sch_ref_lines[1]
+            line = pattern.sub(lambda m: m[1] + _power_ref(m[2], timestamp, smudge) + m[3], line)
+        elif line.startswith("AR "):
+            line = _sch_ref_lines[2].sub(lambda m: m[1] + _power_ref(m[3], m[2], smudge) + m[4], line)
+        result.append(line)
+    return result
+
+def filter_sch(text, smudge=False):
+    """Normalize the references of power symbols and flags in a `*.sch` file
+    to `#PWR?`/`#FLG?` (or, if `smudge`, number them from each component's
+    timestamp or sheet path). Other components are unchanged.
+    """
+    lines = text.splitlines(keepends=True)
+    result, component = [], None
+    for line in lines:
+        if component is None:
+            if line.startswith("$Comp"):
+                component = [line]
+            else:
+                result.append(line)
+        else:
+            component.append(line)
+            if line.startswith("$EndComp"):
+                result += _filter_sch_component(component, smudge)
+                component = None
+    return "".join(result + (component or []))
+
+# Cell
+_max_packet = 65516
+
+def _read_packet(stream):
+    """Read a pkt-line from `stream`. Returns `None` for a flush packet and
+    raises `EOFError` at the end of the stream.
+    """
+    header = stream.read(4)
+    if len(header) < 4:
+        raise EOFError()
+    size = int(header, 16)
+    if size == 0:
+        return None
+    return stream.read(size - 4)
+
+def _read_packets(stream):
+    """Read packets up to the next flush packet."""
+    packets = []
+    while True:
+        packet = _read_packet(stream)
+        if packet is None:
+            return packets
+        packets.append(packet)
+
+def _write_packets(stream, packets=(), flush=True):
+    for packet in packets:
+        for i in range(0, len(packet), _max_packet):
+            chunk = packet[i:i + _max_packet]
+            stream.write(b"%04x" % (len(chunk) + 4) + chunk)
+    if flush:
+        stream.write(b"0000")
+    stream.flush()
+
+def _text_packets(stream):
+    return [packet.decode("utf-8").rstrip("\n") for packet in _read_packets(stream)]
+
+# Cell
+def filter_content(command, pathname, content):
+    """Apply the filter `command` ("clean" or "smudge") to the `content`
+    (bytes) of the file at `pathname`.
+    """
+    text = content.decode("utf-8", "surrogateescape")
+    if pathname.endswith(".pro") and command == "clean":
+        text = clean_pro(text)
+    elif pathname.endswith(".sch"):
+        text = filter_sch(text, smudge=command == "smudge")
+    return text.encode("utf-8", "surrogateescape")
+
+def git_filter_process(stdin=None, stdout=None):
+    """Run the long-running filter process (see `filter.<driver>.process` in
+    `gitattributes(5)`) until git closes its input.
+    """
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    try:
+        if _text_packets(stdin) != ["git-filter-client", "version=2"]:
+            raise RuntimeError("Unexpected git filter protocol handshake.")
+        _write_packets(stdout, [b"git-filter-server\n", b"version=2\n"])
+        capabilities = {"capability=clean", "capability=smudge"} & set(_text_packets(stdin))
+    except EOFError:
+        return
+    _write_packets(stdout, [f"{ capability }\n".encode("utf-8") for capability in sorted(capabilities)])
+
+    while True:
+        try:
+            request = dict(packet.split("=", 1) for packet in _text_packets(stdin))
+            content = b"".join(_read_packets(stdin))
+        except EOFError:
+            return
+        try:
+            content = filter_content(request["command"], request.get("pathname", ""), content)
+        except Exception as e:
+            print(f"kh_git_filter: { request.get('pathname') }: { e !r}", file=sys.stderr)
+            _write_packets(stdout, [b"status=error\n"])
+            continue
+        _write_packets(stdout, [b"status=success\n"])
+        _write_packets(stdout, [content] if content else [])
+        _write_packets(stdout)
\ No newline at end of file
@@ -0,0 +1,200 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: notebooks/06_parts.ipynb (unless otherwise specified).
+
+__all__ = ['PartInfoCache', 'PartInfoBackend', 'JsonPartInfoBackend', 'KitspacePartInfoBackend', 'get_part_info',
+           'enrich_bom']
+
+# Cell
+import abc
+import json
+import os
+import sqlite3
+import time
+import urllib.request
+
+from kicad_helpers import *
+from .utilities import _cache_dir
+
+# Cell
+class PartInfoCache:
+    """A SQLite cache of part information, keyed on the backend's `cache_key`
+    and the `(manufacturer, mpn)` of each part. Entries older than `ttl`
+    seconds are ignored and evicted.
+    """
+    def __init__(self, path=None, ttl=7 * 24 * 60 * 60):
+        if path is None:
+            path = os.path.join(_cache_dir(), "parts.sqlite")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path, self.ttl = path, ttl
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS parts (backend TEXT, manufacturer TEXT, mpn TEXT, "
+                       "info TEXT, fetched REAL, PRIMARY KEY (backend, manufacturer, mpn))")
+            db.execute("CREATE INDEX IF NOT EXISTS parts_fetched ON parts (fetched)")
+
+    def __repr__(self):
+        return f"PartInfoCache({ self.path !r})"
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def get(self, backend, keys):
+        """Get a dictionary mapping each of the `keys` that has a fresh entry
+        to its cached info (`None` if the backend didn't find the part).
+        """
+        keys = list(keys)
+        found = {}
+        with self._connect() as db:
+            for i in range(0, len(keys), 400):
+                chunk = keys[i:i + 400]
+                rows = db.execute(
+                    "SELECT manufacturer, mpn, info FROM parts WHERE backend = ? AND fetched >= ? "
+                    f"AND (manufacturer, mpn) IN (VALUES { ', '.join(['(?, ?)'] * len(chunk)) })",
+                    [backend, time.time() - self.ttl] + [value for key in chunk for value in key])
+                for manufacturer, mpn, info in rows:
+                    found[(manufacturer, mpn)] = None if info is None else json.loads(info)
+        return found
+
+    def put(self, backend, infos):
+        """Store `infos` (a dictionary mapping `(manufacturer, mpn)` keys to
+        info dictionaries or `None`) and evict expired entries.
+        """
+        now = time.time()
+        with self._connect() as db:
+            db.executemany("INSERT OR REPLACE INTO parts VALUES (?, ?, ?, ?, ?)",
+                           [(backend, manufacturer, mpn, None if info is None else json.dumps(info), now)
+                            for (manufacturer, mpn), info in infos.items()])
+            db.execute("DELETE FROM parts WHERE fetched < ?", (now - self.ttl,))
+
+# Cell
+class PartInfoBackend(abc.ABC):
+    """Base class for sources of part information.
+    """
+    name = None
+    batch_size = 50
+
+    @property
+    def cache_key(self):
+        """The key of the backend's entries in a `PartInfoCache`, which must
+        differ between sources of part information (e.g., the name and path
+        or URL of the source).
+        """
+        return self.name
+
+    @abc.abstractmethod
+    def lookup(self, keys):
+        """Get a dictionary mapping each of the `(manufacturer, mpn)` `keys`
+        that was found to its info dictionary.
+        """
+
+# Cell
+class JsonPartInfoBackend(PartInfoBackend):
+    """Part information from a JSON file (or http(s) URL) containing a list
+    of info dictionaries, each with "Manufacturer" and "MPN" keys. Useful
+    for offline use and testing.
+    """
+    name = "json"
+
+    def __init__(self, path):
+        self.path = path
+        self._parts = None
+
+    @property
+    def cache_key(self):
+        if self.path.startswith(("http://", "https://")):
+            return f"{ self.name }:{ self.path }"
+        return f"{ self.name }:{ os.path.abspath(self.path) }"
+
+    def _load(self):
+        if self.path.startswith(("http://", "https://")):
+            with urllib.request.urlopen(self.path) as response:
+                return json.load(response)
+        with open(self.path) as f:
+            return json.load(f)
+
+    def lookup(self, keys):
+        if self._parts is None:
+            self._parts = {(part.get("Manufacturer", ""), part["MPN"]): part for part in self._load()}
+        return {key: self._parts[key] for key in keys if key in self._parts}
+
+# Cell
+_kitspace_part_fields = """
+    mpn { manufacturer part }
+    type
+    datasheet
+    description
+    specs { key name value }
+    offers { sku { vendor part } moq in_stock_quantity prices { USD EUR GBP } }
+"""
+
+class KitspacePartInfoBackend(PartInfoBackend):
+    """Part information from the [Kitspace partinfo](https://github.com/kitspace/partinfo)
+    GraphQL API. Each batch of parts is looked up in a single request.
+    """
+    name = "kitspace"
+    batch_size = 20
+
+    def __init__(self, endpoint="https://dev-partinfo.kitspace.org/graphql"):
+        self.endpoint = endpoint
+
+    @property
+    def cache_key(self):
+        return f"{ self.name }:{ self.endpoint }"
+
+    def lookup(self, keys):
+        variables = {}
+        for i, (manufacturer, mpn) in enumerate(keys):
+            variables[f"p{ i }"] = {"part": mpn, **({"manufacturer": manufacturer} if manufacturer else {})}
+        query = ("query (" + ", ".join(f"${ name }: MpnInput!" for name in variables) + ") {\n"
+                 + "\n".join(f"{ name }: part(mpn: ${ name }) {{{ _kitspace_part_fields }}}" for name in variables)
+                 + "\n}")
+        request = urllib.request.Request(self.endpoint, json.dumps({"query": query, "variables": variables}).encode(),
+                                         {"Accept": "application/json", "Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            data = json.load(response)
+        if data.get("errors"):
+            raise RuntimeError(f"Part lookup failed: { data['errors'] }")
+        return {key: data["data"][f"p{ i }"] for i, key in enumerate(keys) if data["data"].get(f"p{ i }")}
+
+# Cell
+def get_part_info(keys, backend, cache=None):
+    """Get a dictionary mapping each unique `(manufacturer, mpn)` in `keys`
+    to its info from `backend` (`None` for parts it doesn't know). Cached
+    info is reused and the other parts are looked up in batches.
+    """
+    if cache is None:
+        cache = PartInfoCache()
+    keys = list(dict.fromkeys((manufacturer.strip(), mpn.strip()) for manufacturer, mpn in keys if mpn.strip()))
+    infos = cache.get(backend.cache_key, keys)
+    missing = [key for key in keys if key not in infos]
+    for i in range(0, len(missing), backend.batch_size):
+        batch = missing[i:i + backend.batch_size]
+        found = backend.lookup(batch)
+        batch_infos = {key: found.get(key) for key in batch}
+        cache.put(backend.cache_key, batch_infos)
+        infos.update(batch_infos)
+    return {key: infos[key] for key in keys}
+
+# Cell
+def enrich_bom(root=".", backend=None, fields=("description", "datasheet"), cache=None):
+    """Get the project's BOM as a `pandas.DataFrame` with a column added for
+    each of the info `fields` (empty for parts that weren't found). If the
+    BOM already has a column, only its empty (or "~") values are filled in.
+    Uses the Kitspace backend by default.
+    """
+    import pandas as pd
+
+    if backend is None:
+        backend = KitspacePartInfoBackend()
+    bom = pd.read_csv(get_bom_path(root), dtype=str, keep_default_na=False)
+    if "MPN" not in bom.columns:
+        raise RuntimeError("The BOM has no MPN column.")
+    manufacturers = bom["Manufacturer"] if "Manufacturer" in bom.columns else pd.Series("", index=bom.index)
+    keys = list(zip(manufacturers.str.strip(), bom["MPN"].str.strip()))
+    infos = get_part_info(keys, backend, cache=cache)
+    for field in fields:
+        values = [str((infos.get(key) or {}).get(field) or "") for key in keys]
+        if field in bom.columns:
+            values = [old if old.strip() not in ("", "~") or not new else new for old, new in zip(bom[field], values)]
+        bom[field] = values
+    return bom
\ No newline at end of file
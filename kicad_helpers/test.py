@@ -1,74 +1,417 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: notebooks/01_test.ipynb (unless otherwise specified).
 
-__all__ = ['test_erc', 'test_drc', 'validate_bom', 'test_notebooks']
+__all__ = ['test_erc', 'test_drc', 'read_bom', 'explode_bom_refs', 'check_bom', 'validate_bom', 'load_test_history',
+           'KernelPool', 'run_test_notebooks', 'test_notebooks']
 
 # Cell
+import configparser
+import contextlib
+import hashlib
+import json
+import math
 import os
+import queue
+import re
 import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from fastcore.script import *
-from nbdev.test import *
-from nbdev.test import nbglob, num_cpus, parallel, _test_one, Path
-import pandas as pd
-import pandera as pa
 from kicad_helpers import *
-from .utilities import _set_root, _print_cmd_output
+from .utilities import _set_root, _print_cmd_output, _inputs_key, _cache_dir
 
 # Cell
-def test_erc(root="."):
+def _test_check(kind, root="."):
+    """Run the KiBot `erc.yaml` or `drc.yaml` config (`kind` is "erc" or
+    "drc") and assert that it passes. A passing result is stored (see
+    `CheckResults`), so the check is skipped until its inputs change.
+    """
+    project = get_project(root)
+    config = f".kicad_helpers_config/{ kind }.yaml"
+    container = "setsoft/kicad_auto_test:latest"
+    inputs = [os.path.join(project.root, config)]
+    if kind == "erc":
+        inputs += [schematic.path for schematic in get_schematic_hierarchy(project)]
+        report_path = os.path.join(project.root, project.name + ".erc")
+    else:
+        inputs.append(project.board_path)
+        report_path = os.path.join(project.root, "drc_result.rpt")
+    key_fn = lambda: _inputs_key(project, inputs, container, f"test_{ kind }")
+    results = CheckResults(project)
+    key = key_fn()
+    if key is not None:
+        result = results.get(f"test_{ kind }", key)
+        if result is not None and result.returncode == 0:
+            return
+
     returncode = 0
-    config = f".kicad_helpers_config/erc.yaml"
     try:
-        output = run_kibot_docker(config=config, root=root)
+        output = run_kibot_docker(config=config, root=project)
     except subprocess.CalledProcessError as e:
         returncode = e.returncode
         print(e.output.decode("utf-8"))
         print(f"returncode = { returncode }")
-    erc_path = os.path.join(root, get_project_name(root) + ".erc")
-    if os.path.exists(erc_path):
-        os.remove(erc_path)
+    report = ""
+    if os.path.exists(report_path):
+        with open(report_path) as f:
+            report = f.read()
+        os.remove(report_path)
+    key = key or key_fn()
+    if key is not None:
+        result = results.add(f"test_{ kind }", key, report, returncode)
+        if returncode != 0:
+            print(result.summary())
     assert returncode == 0
 
+# Cell
+def test_erc(root="."):
+    _test_check("erc", root)
+
 # Cell
 def test_drc(root="."):
-    returncode = 0
-    config = f".kicad_helpers_config/drc.yaml"
+    _test_check("drc", root)
+
+# Cell
+def read_bom(path, engine=None):
+    """Read a BOM CSV file with every column as a string (empty values are
+    kept as empty strings). `engine` is passed to `pandas.read_csv` (e.g.,
+    "pyarrow" to use the multithreaded pyarrow parser, if it's installed).
+    """
+    import pandas as pd
+
+    with trace_span("read BOM", "io", path=path):
+        return pd.read_csv(path, dtype=str, keep_default_na=False, engine=engine)
+
+_bom_ref = r"^(?P<prefix>.*?)(?P<start>\d+)(?:-(?P=prefix)?(?P<end>\d+))?$"
+
+def explode_bom_refs(bom):
+    """Get a `pandas.Series` with one reference per part (ranges such as
+    "R1-R3" are expanded), indexed by the BOM row containing it. Reversed
+    ranges (e.g., "R3-R1") only give their first reference (the
+    `ref_ranges` rule reports them).
+    """
+    import numpy as np
+    import pandas as pd
+
+    refs = bom["Refs"].str.split(",").explode().str.strip()
+    refs = refs[refs.notna() & (refs != "")]
+    parts = refs.str.extract(_bom_ref)
+    ranged = parts["end"].notna().to_numpy()
+    if not ranged.any():
+        return refs
+
+    # Repeat each range once per reference and number the repeats
+    start = parts["start"].fillna(0).astype(int).to_numpy()
+    end = parts["end"].fillna(0).astype(int).to_numpy()
+    counts = np.where(ranged, np.maximum(end - start + 1, 1), 1)
+    rows = np.repeat(np.arange(len(refs)), counts)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    values = refs.to_numpy()[rows]
+    in_range = ranged[rows]
+    values[in_range] = (parts["prefix"].to_numpy()[rows][in_range]
+                        + (start[rows] + offsets)[in_range].astype(str).astype(object))
+    return pd.Series(values, index=refs.index[rows], name=refs.name)
+
+# Cell
+_bom_columns = ["Refs", "Quantity", "MPN", "Manufacturer", "footprint", "value"]
+
+def _duplicate_refs_rule(bom, refs):
+    duplicates = refs[refs.duplicated(keep=False)]
+    return "references listed more than once: " + duplicates.groupby(level=0).agg(lambda refs: ", ".join(refs.unique()))
+
+def _ref_ranges_rule(bom, refs):
+    ranges = bom["Refs"].str.split(",").explode().str.strip()
+    parts = ranges.str.extract(_bom_ref)
+    reversed_ = parts["end"].notna() & (parts["end"].fillna(0).astype(int) < parts["start"].fillna(0).astype(int))
+    return "reversed reference range: " + ranges[reversed_].groupby(level=0).agg(", ".join)
+
+def _quantity_rule(bom, refs):
+    counts = refs.groupby(level=0).size().reindex(bom.index, fill_value=0)
+    quantity = bom["Quantity"].str.strip()
+    bad = quantity != counts.astype(str)
+    return ("Quantity (" + quantity[bad] + ") doesn't match the number of references ("
+            + counts[bad].astype(str) + ")")
+
+def _mpn_rule(bom, refs):
+    no_mpn = bom["MPN"] == ""
+    no_manufacturer = ~no_mpn & (bom["Manufacturer"] == "")
+    messages = ("no MPN" + (" from " + bom["Manufacturer"]).where(bom["Manufacturer"] != "", "")
+                ).where(no_mpn, "no Manufacturer for MPN " + bom["MPN"])
+    return messages[no_mpn | no_manufacturer]
+
+def _footprint_value_rule(bom, refs):
+    parts = bom[bom["MPN"] != ""]
+    n = parts.groupby(["Manufacturer", "MPN"])[["footprint", "value"]].transform("nunique")
+    bad = (n > 1).any(axis=1)
+    return ("MPN " + parts["MPN"][bad] + " is listed with a different footprint or value on another line")
+
+_bom_rules = {
+    "duplicate_refs": _duplicate_refs_rule,
+    "ref_ranges": _ref_ranges_rule,
+    "quantity": _quantity_rule,
+    "mpn": _mpn_rule,
+    "footprint_value": _footprint_value_rule,
+}
+
+# Cell
+def check_bom(root=".", rules=None, engine=None):
+    """Check the project's BOM against `rules` (a dictionary mapping names
+    to rule functions; the built-in rules by default). Returns a
+    `pandas.DataFrame` with the `row`, `Refs`, `rule` and `message` of each
+    problem found (empty if the BOM is valid).
+    """
+    import pandas as pd
+
+    bom = read_bom(get_bom_path(root), engine=engine)
+    columns = ["row", "Refs", "rule", "message"]
+    missing = [column for column in _bom_columns if column not in bom.columns]
+    if missing:
+        return pd.DataFrame([(None, "", "columns", f"missing column { column }") for column in missing],
+                            columns=columns)
+
+    if rules is None:
+        rules = _bom_rules
+    refs = explode_bom_refs(bom)
+    reports = []
+    for name, rule in rules.items():
+        with trace_span(name, "BOM rule"):
+            messages = rule(bom, refs)
+        if len(messages):
+            reports.append(pd.DataFrame({"row": messages.index, "Refs": bom["Refs"][messages.index].to_numpy(),
+                                         "rule": name, "message": messages.to_numpy()}))
+    if not reports:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(reports, ignore_index=True).sort_values("row", kind="stable", ignore_index=True)
+
+# Cell
+def validate_bom(root=".", rules=None, engine=None):
+    """Validate the project's BOM (see `check_bom`), raising a
+    `RuntimeError` listing every problem if it's invalid. Returns the BOM
+    (with an integer `Quantity` column and every other column as a string).
+    """
+    report = check_bom(root, rules=rules, engine=engine)
+    if len(report):
+        raise RuntimeError(f"The BOM has { len(report) } problem(s):\n" + report.to_string(index=False))
+    bom = read_bom(get_bom_path(root), engine=engine)
+    bom["Quantity"] = bom["Quantity"].str.strip().astype(int)
+    return bom
+
+# Cell
+def _test_history_path(project):
+    name = hashlib.sha1(project.root.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(_cache_dir(), "tests", f"{ project.name }-{ name }.json")
+
+def load_test_history(root="."):
+    """Get the stored results of the project's test notebooks (a dictionary
+    mapping each notebook's name to its `seconds`, whether it `passed` and
+    the `key` of its inputs when it last passed).
+    """
     try:
-        output = run_kibot_docker(config=config, root=root)
-    except subprocess.CalledProcessError as e:
-        returncode = e.returncode
-        print(e.output.decode("utf-8"))
-        print(f"returncode = { returncode }")
-    drc_path = os.path.join(root, "drc_result.rpt")
-    if os.path.exists(drc_path):
-        os.remove(drc_path)
-    assert returncode == 0
+        with open(_test_history_path(get_project(root))) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _save_test_history(root, history):
+    path = _test_history_path(get_project(root))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "w") as f:
+        json.dump(history, f)
+    os.replace(tmp_path, path)
+
+def _notebook_inputs_key(root, fname, flags=None):
+    """Get a key for the inputs of the test notebook `fname` (the notebook,
+    the schematic hierarchy, board, BOM, ERC/DRC configs and the test
+    container image), or `None` if it can't be computed.
+    """
+    project = get_project(root)
+    paths = [str(fname)]
+    if os.path.exists(project.schematic_path):
+        paths += [schematic.path for schematic in get_schematic_hierarchy(project)]
+    paths += [path for path in [project.board_path, project.bom_path,
+                                os.path.join(project.root, ".kicad_helpers_config", "erc.yaml"),
+                                os.path.join(project.root, ".kicad_helpers_config", "drc.yaml")]
+              if os.path.exists(path)]
+    return _inputs_key(project, paths, "setsoft/kicad_auto_test:latest", "test_notebook", " ".join(flags or []))
+
+def _schedule_notebooks(files, history, max_workers):
+    """Order `files` longest first (by their last run time; notebooks that
+    haven't been timed go first) and choose the number of workers: more than
+    the total time divided by the longest notebook can't finish any sooner.
+    Returns `(files, n_workers)`.
+    """
+    times = {f: history.get(f.name, {}).get("seconds") for f in files}
+    files = sorted(files, key=lambda f: -times[f] if times[f] is not None else -math.inf)
+    n_workers = min(max_workers, len(files))
+    if None not in times.values() and max(times.values()) > 0:
+        n_workers = min(n_workers, math.ceil(sum(times.values()) / max(times.values())))
+    return files, n_workers if n_workers > 1 else 0
 
 # Cell
-def validate_bom(root="."):
-    df = pd.read_csv(get_bom_path(root))
-    schema = pa.DataFrameSchema({
-        "Refs": pa.Column(str),
-        "Quantity": pa.Column(int),
-        "MPN": pa.Column(str),
-        "Manufacturer": pa.Column(str),
-        "datasheet": pa.Column(str, nullable=True, coerce=True),
-        "footprint": pa.Column(str),
-        "value": pa.Column(str),
-    })
-
-    return schema.validate(df)
+class KernelPool:
+    """A pool of up to `size` warm Jupyter kernels (with `setup` code, e.g.
+    imports, already run) for executing test notebooks. Kernels are reused:
+    before each notebook the kernel's namespace is reset and its working
+    directory is set, so nothing depends on the process's working directory
+    and pools can be shared by tests of several projects at once.
+    """
+    def __init__(self, size=1, kernel_name="python3", setup="import kicad_helpers", pause=0):
+        self.size, self.kernel_name, self.setup, self.pause = max(1, size), kernel_name, setup, pause
+        self._idle = queue.Queue()
+        self._kernels = []
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def _start_kernel(self):
+        from jupyter_client import KernelManager
+
+        # Start kernels one at a time (waiting `pause` seconds between them) to avoid port conflicts
+        with self._start_lock:
+            km = KernelManager(kernel_name=self.kernel_name)
+            km.start_kernel(env={**os.environ, "IN_TEST": "1"})
+            time.sleep(self.pause)
+        self._execute(km, self.setup)
+        return km
+
+    def _execute(self, km, code):
+        kc = km.client()
+        kc.start_channels()
+        try:
+            kc.wait_for_ready(timeout=60)
+            reply = kc.execute_interactive(code, store_history=False, timeout=600, output_hook=lambda msg: None)
+        finally:
+            kc.stop_channels()
+        if reply["content"]["status"] != "ok":
+            raise RuntimeError(f"Error running { code !r} in a kernel: { reply['content'].get('evalue') }")
+
+    @contextlib.contextmanager
+    def kernel(self, cwd):
+        """Context manager that gets a kernel manager for a kernel (starting a
+        new one if none are idle and the pool isn't full) with a clean
+        namespace and `cwd` as its working directory.
+        """
+        km = None
+        with self._lock:
+            if self._idle.empty() and len(self._kernels) < self.size:
+                self._kernels.append(None)
+                start = True
+            else:
+                start = False
+        if start:
+            try:
+                km = self._start_kernel()
+            finally:
+                with self._lock:
+                    self._kernels.remove(None)
+                    if km is not None:
+                        self._kernels.append(km)
+        else:
+            km = self._idle.get()
+        try:
+            self._execute(km, f"%reset -f\nimport os as _os; _os.chdir({ str(cwd) !r}); del _os")
+            yield km
+        finally:
+            if km.is_alive():
+                self._idle.put(km)
+            else:
+                with self._lock:
+                    self._kernels.remove(km)
+
+    def shutdown(self):
+        """Shut down all of the kernels."""
+        with self._lock:
+            kernels, self._kernels = [km for km in self._kernels if km is not None], []
+        for km in kernels:
+            km.shutdown_kernel(now=True)
+        self._idle = queue.Queue()
 
 # Cell
+def _test_flags(path):
+    """Get the test flags (the `tst_flags` in the nearest `settings.ini`
+    above `path`, plus "skip"), like `nbdev` but without depending on the
+    current working directory.
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(os.path.join(path, "settings.ini")) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    config = configparser.ConfigParser()
+    config.read(os.path.join(path, "settings.ini"))
+    return [flag for flag in config["DEFAULT"].get("tst_flags", "").split("|") if flag] + ["skip"]
+
+def _test_notebook(fname, pool, flags=None, verbose=True):
+    """Execute the notebook `fname` in a kernel from `pool` (with the
+    notebook's directory as the working directory). As with `nbdev_test_nbs`,
+    cells with test flags that aren't in `flags` are skipped, as are
+    notebooks with an `all_` flag that isn't in `flags`. Returns a
+    `(passed, seconds)` tuple.
+    """
+    import nbformat
+    from nbconvert.preprocessors import ExecutePreprocessor
+
+    if flags is None: flags = []
+    start = time.time()
+    try:
+        nb = nbformat.read(fname, as_version=4)
+        dirname = os.path.dirname(os.path.abspath(fname))
+        re_flag = re.compile(rf"^\s*#\s*(all_)?({ '|'.join(map(re.escape, _test_flags(dirname))) })\s*$",
+                             re.MULTILINE | re.IGNORECASE)
+        cells = [cell for cell in nb.cells if cell.cell_type == "code"]
+        if any(all_ and flag not in flags for cell in cells for all_, flag in re_flag.findall(cell.source)):
+            return True, 0.
+        nb.cells = [cell for cell in cells if "notebook2script(" not in cell.source and
+                    all(flag in flags for all_, flag in re_flag.findall(cell.source))]
+        if verbose: print(f"testing {fname}")
+        with pool.kernel(dirname) as km:
+            ep = ExecutePreprocessor(timeout=600, kernel_name=pool.kernel_name)
+            try:
+                ep.preprocess(nb, {}, km=km)
+            finally:
+                if ep.kc is not None:
+                    ep.kc.stop_channels()
+        return True, time.time() - start
+    except Exception as e:
+        if verbose: print(f'Error in {fname}:\n{e}')
+        return False, time.time() - start
+
+def run_test_notebooks(files, flags=None, n_workers=1, verbose=True, pool=None):
+    """Test the notebooks in `files` (in order) on `n_workers` threads.
+    Kernels come from `pool` (a new `KernelPool` of `n_workers` kernels by
+    default), which can be shared to test several projects concurrently.
+    Returns a list of `(passed, seconds)` tuples.
+    """
+    n_workers = max(1, n_workers)
+    if pool is None:
+        with KernelPool(n_workers) as pool:
+            return run_test_notebooks(files, flags=flags, n_workers=n_workers, verbose=verbose, pool=pool)
+    with ThreadPoolExecutor(n_workers) as executor:
+        return list(executor.map(lambda f: _test_notebook(f, pool, flags=flags, verbose=verbose), files))
+
+# Cell
+@profiled
 @call_parse
 def test_notebooks(fname:Param("A notebook name or glob to convert", str)=None,
                    flags:Param("Space separated list of flags", str)=None,
                    n_workers:Param("Number of workers to use", int)=None,
                    verbose:Param("Print errors along the way", bool_arg)=True,
                    timing:Param("Timing each notebook to see the ones are slow", bool)=False,
-                   pause:Param("Pause time (in secs) between notebooks to avoid race conditions", float)=0.5,
+                   pause:Param("Pause time (in secs) between kernel launches to avoid port conflicts", float)=0.5,
+                   force:Param("Run notebooks whose inputs haven't changed since they last passed", bool)=False,
                    root:Param("project root directory", str)="."):
-    """Test all notebooks matching `fname` in parallel, passing along `flags`"""
+    """Test all notebooks matching `fname` in parallel, passing along `flags`.
+    Notebooks run longest first (based on previous runs) and notebooks that
+    passed with the same inputs last time are skipped (unless `force`).
+    """
+    from nbdev.test import nbglob, num_cpus, Path
+
     root = _set_root(root)
     if flags is not None: flags = flags.split(' ')
     if fname is None:
@@ -76,11 +419,24 @@ def test_notebooks(fname:Param("A notebook name or glob to convert", str)=None,
     files = nbglob(fname, recursive=False)
     files = [Path(f).absolute() for f in sorted(files)]
     assert len(files) > 0, "No files to test found."
-    if n_workers is None: n_workers = 0 if len(files)==1 else min(num_cpus(), 8)
-    # make sure we are inside the tests folder
-    os.chdir(os.path.join(root, "tests"))
-    results = parallel(_test_one, files, flags=flags, verbose=verbose, n_workers=n_workers, pause=pause)
+
+    history = load_test_history(root)
+    keys = {f: _notebook_inputs_key(root, f, flags) for f in files}
+    if not force:
+        for f in [f for f in files if keys[f] is not None and history.get(f.name, {}).get("key") == keys[f]]:
+            print(f"Skipping {f.name} (its inputs haven't changed since it passed)")
+            files.remove(f)
+    if len(files) == 0:
+        print("All tests are passing!")
+        return
+    files, workers = _schedule_notebooks(files, history, min(num_cpus(), 8))
+    if n_workers is None: n_workers = workers
+    with KernelPool(max(1, n_workers), pause=pause) as pool:
+        results = run_test_notebooks(files, flags=flags, n_workers=n_workers, verbose=verbose, pool=pool)
     passed,times = [r[0] for r in results],[r[1] for r in results]
+    for f, p, t in zip(files, passed, times):
+        history[f.name] = {"seconds": t, "passed": p, "key": keys[f] if p else None}
+    _save_test_history(root, history)
     if all(passed): print("All tests are passing!")
     else:
         msg = "The following notebooks failed:\n"
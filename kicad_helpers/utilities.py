@@ -1,20 +1,38 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: notebooks/02_utilities.ipynb (unless otherwise specified).
 
-__all__ = ['get_git_root', 'setup_test_repo', 'get_project_name', 'get_project_metadata', 'get_schematic_path',
-           'get_bom_path', 'get_board_path', 'get_manufacturers', 'get_gitignore_list', 'in_gitignore',
-           'run_docker_cmd', 'run_kibot_docker', 'get_board_metadata', 'update_board_metadata',
-           'get_schematic_metadata', 'update_schematic_metadata', 'github_badge', 'kitspace_badge']
+__all__ = ['trace_span', 'start_profiling', 'stop_profiling', 'profile_summary', 'profiled', 'run_cmd_async', 'run_cmd',
+           'get_git_root', 'setup_test_repo', 'KicadProject', 'get_project', 'get_project_name', 'get_project_metadata',
+           'get_schematic_path', 'get_bom_path', 'get_board_path', 'get_manufacturers', 'GitignoreMatcher',
+           'get_gitignore_matcher', 'get_gitignore_list', 'in_gitignore', 'run_docker_cmd_async', 'run_docker_cmd',
+           'stop_docker_containers', 'run_kibot_docker', 'SexprAtom', 'SexprNode', 'parse_sexpr', 'find_sexpr',
+           'get_board_metadata', 'update_board_metadata', 'SchematicComponent', 'SchematicSheet', 'Schematic',
+           'get_schematic', 'get_sheet_instances', 'get_schematic_hierarchy', 'get_schematic_components',
+           'get_schematic_metadata', 'update_schematic_metadata', 'parse_check_report', 'Violation', 'CheckResult',
+           'CheckResults', 'run_check', 'github_badge', 'kitspace_badge']
 
 # Cell
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
 import glob
+import hashlib
+import json
 import os
 import re
+import shlex
+import shutil
 import subprocess
+import sys
 import tempfile
-from pprint import pprint
+import textwrap
+import threading
+import time
 import urllib.parse
+import uuid
+from collections import namedtuple
+from pprint import pprint
 
-import git
 from yaml import load, dump
 try:
     from yaml import CLoader as Loader, CDumper as Dumper
@@ -23,242 +41,1609 @@ except ImportError:
 from fastcore.script import *
 
 # Cell
-def _run_cmd(cmd):
-    return subprocess.check_output(cmd, stderr=subprocess.STDOUT, shell=True).decode("utf-8")
+_trace_events = None # Chrome trace events, while profiling
+_trace_start = 0
+
+@contextlib.contextmanager
+def trace_span(name, cat="kh", **args):
+    """Context manager that records a span called `name` (in the category
+    `cat`, with `args` as details) while profiling is enabled.
+    """
+    if _trace_events is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        _trace_events.append({"name": name, "cat": cat, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                              "ts": (start - _trace_start) * 1e6, "dur": (end - start) * 1e6,
+                              "args": {key: str(value) for key, value in args.items()}})
+
+def start_profiling():
+    """Start recording spans (see `trace_span`)."""
+    global _trace_events, _trace_start
+    _trace_events, _trace_start = [], time.perf_counter()
+
+def stop_profiling(path=None):
+    """Stop recording spans and return them. If `path` is given, they are
+    also written to it as a Chrome trace.
+    """
+    global _trace_events
+    events, _trace_events = _trace_events or [], None
+    if path is not None:
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return events
+
+def profile_summary(events):
+    """Format a table of the total time, longest time and number of the
+    spans in `events` with each category and name, slowest first.
+    """
+    totals = {}
+    for event in events:
+        count, total, longest = totals.get((event["cat"], event["name"]), (0, 0, 0))
+        totals[(event["cat"], event["name"])] = (count + 1, total + event["dur"] / 1e6, max(longest, event["dur"] / 1e6))
+    lines = [f"{ 'total (s)' :>10} { 'max (s)' :>9} { 'count' :>6}  span"]
+    for (cat, name), (count, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        lines.append(f"{ total :10.3f} { longest :9.3f} { count :6d}  { cat }: { name }")
+    return "\n".join(lines)
+
+def _pop_profile_arg(argv):
+    """Remove `--profile[=PATH]` from `argv` and return the path of the trace
+    to write (from the argument or the `KH_PROFILE` environment variable),
+    or `None` if profiling isn't enabled.
+    """
+    path = None
+    for arg in list(argv[1:]):
+        if arg == "--profile" or arg.startswith("--profile="):
+            argv.remove(arg)
+            path = arg.partition("=")[2] or "kh-profile.json"
+    if path is None and os.getenv("KH_PROFILE"):
+        path = os.getenv("KH_PROFILE")
+        if path == "1":
+            path = "kh-profile.json"
+    return path
+
+def profiled(func):
+    """Decorator for command line scripts (defined with `call_parse`) that
+    adds profiling with `--profile[=PATH]` or the `KH_PROFILE` environment
+    variable. Like `call_parse`, `__wrapped__` is the undecorated function.
+
+    Calling the decorated function always runs the undecorated function.
+    The script itself, which parses `sys.argv`, is run by its `main`
+    attribute: the entry point of its console script.
+    """
+    undecorated = getattr(func, "__wrapped__", func)
+
+    @functools.wraps(undecorated)
+    def _f(*args, **kwargs):
+        return undecorated(*args, **kwargs)
 
-def _print_cmd_output(cmd):
-    print(_run_cmd(cmd))
+    def main():
+        path = _pop_profile_arg(sys.argv)
+        if path is None or _trace_events is not None:
+            return func()
+        start_profiling()
+        try:
+            with trace_span(undecorated.__name__, "script"):
+                return func()
+        finally:
+            events = stop_profiling(path)
+            print(profile_summary(events) + f"\nWrote a trace of { len(events) } spans to { path }", file=sys.stderr)
+    _f.main = main
+    return _f
 
 # Cell
+def _run_sync(coro):
+    """Run the coroutine `coro` to completion and return its result (in a
+    new thread if this thread is already running an event loop, e.g., in a
+    notebook).
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+async def _run_in_thread(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+def _print_line(line, stream):
+    print(line, file=sys.stderr if stream == "stderr" else sys.stdout, flush=True)
+
+async def _read_lines(stream, name, output, on_line):
+    """Append the chunks read from the asyncio `stream` to `output`, and call
+    `on_line(line, name)` with each line (if `on_line` isn't `None`).
+    """
+    partial = b""
+    while True:
+        chunk = await stream.read(1 << 16)
+        if not chunk:
+            break
+        output.append(chunk)
+        if on_line is not None:
+            *lines, partial = (partial + chunk).split(b"\n")
+            for line in lines:
+                on_line(line.decode("utf-8", "replace").rstrip("\r"), name)
+    if on_line is not None and partial:
+        on_line(partial.decode("utf-8", "replace").rstrip("\r"), name)
+
+async def _stop_process(proc, kill=None, grace=5):
+    """Stop the asyncio process `proc`, after running the command `kill` (if
+    any), terminating it and then killing it if it doesn't exit within
+    `grace` seconds.
+    """
+    if kill is not None:
+        try:
+            await run_cmd_async(kill, timeout=grace)
+        except (subprocess.SubprocessError, OSError):
+            pass
+    if proc.returncode is None:
+        try:
+            proc.terminate()
+            await asyncio.wait_for(proc.wait(), grace)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+
+async def run_cmd_async(args, cwd=None, env=None, timeout=None, on_line=None, kill=None):
+    """Run the command `args` (a list of arguments, which aren't interpreted
+    by a shell) and return its output (stdout and stderr, as bytes), like
+    `subprocess.check_output(args, stderr=subprocess.STDOUT)`.
+
+    Each line of output is passed to `on_line(line, stream)` (where `stream`
+    is "stdout" or "stderr") as soon as it's read. If the command doesn't
+    finish within `timeout` seconds or the task running it is cancelled,
+    the command `kill` is run (e.g., to stop the processes it started in a
+    container) and the process is terminated, then
+    `subprocess.TimeoutExpired` (or `asyncio.CancelledError`) is raised.
+    Raises `subprocess.CalledProcessError` if the command fails.
+    """
+    args = [str(arg) for arg in args]
+    output = []
+    with trace_span(os.path.basename(args[0]), "subprocess", cmd=" ".join(shlex.quote(arg) for arg in args)):
+        proc = await asyncio.create_subprocess_exec(*args, cwd=cwd, env=env, stdin=asyncio.subprocess.DEVNULL,
+                                                    stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE)
+        try:
+            await asyncio.wait_for(asyncio.gather(_read_lines(proc.stdout, "stdout", output, on_line),
+                                                  _read_lines(proc.stderr, "stderr", output, on_line),
+                                                  proc.wait()), timeout)
+        except asyncio.TimeoutError:
+            await _stop_process(proc, kill)
+            raise subprocess.TimeoutExpired(args, timeout, output=b"".join(output)) from None
+        except asyncio.CancelledError:
+            await _stop_process(proc, kill)
+            raise
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args, output=b"".join(output))
+    return b"".join(output)
+
+def run_cmd(args, cwd=None, env=None, timeout=None, on_line=None, kill=None):
+    """Run the command `args` and return its output (see `run_cmd_async`)."""
+    return _run_sync(run_cmd_async(args, cwd=cwd, env=env, timeout=timeout, on_line=on_line, kill=kill))
+
+def _run_cmd(cmd, cwd=None):
+    """Run `cmd` (a list of arguments or, for convenience in notebooks, a
+    command line that's split with `shlex.split`, not run by a shell) and
+    return its output as a string.
+    """
+    if isinstance(cmd, str):
+        cmd = shlex.split(cmd)
+    return run_cmd(cmd, cwd=cwd).decode("utf-8")
+
+def _print_cmd_output(cmd, cwd=None):
+    print(_run_cmd(cmd, cwd=cwd))
+
+# Cell
+def _get_git_repo(path="."):
+    """Get the `git.Repo` containing `path`."""
+    import git
+    return git.Repo(path, search_parent_directories=True)
+
 def get_git_root(path="."):
     # Find the current projects' root directory
-    git_repo = git.Repo(path, search_parent_directories=True)
+    git_repo = _get_git_repo(path)
     return git_repo.git.rev_parse("--show-toplevel").replace("/", os.path.sep)
 
 # Cell
+@profiled
 @call_parse
 def setup_test_repo(root:Param("project root directory", str)="_temp"):
     """Setup a test KiCad repository to test against.
     """
     if not os.path.exists(root):
-        _run_cmd(f"git clone --recursive https://github.com/sci-bots/dropbot-40-channel-HV-switching-board.kicad { root }")
+        _run_cmd(["git", "clone", "--recursive",
+                  "https://github.com/sci-bots/dropbot-40-channel-HV-switching-board.kicad", root])
 
 # Cell
+_git_roots = {}
+
 def _set_root(root):
     """If `root` is the default value ("."), use the project's git root
     or override with the environment variable `KH_PROJECT_ROOT` if it
-    exists.
+    exists. If `root` is a `KicadProject`, return its root directory.
+
+    The git root is resolved once per working directory and cached.
     """
+    if isinstance(root, KicadProject):
+        return root.root
     if root == ".":
-        # Use defaults
-        root = get_git_root(".")
-
         # Override with environment variable if set
-        root = os.getenv("KH_PROJECT_ROOT", root)
+        root = os.getenv("KH_PROJECT_ROOT")
+        if root is None:
+            # Use defaults
+            cwd = os.getcwd()
+            if cwd not in _git_roots:
+                _git_roots[cwd] = get_git_root(cwd)
+            root = _git_roots[cwd]
     return root
 
 # Cell
-def get_project_name(root="."):
-    """Get the project name based on the name of the KiCad `*.pro` file.
+def _stamp(path):
+    """Return a `(mtime_ns, size)` tuple for `path` (or `None` if it doesn't
+    exist) that can be used to invalidate cached data.
     """
-    root = _set_root(root)
-    return os.path.splitext(os.path.split(glob.glob(os.path.join(root, "*.pro"))[0])[1])[0]
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
 
 # Cell
-def get_project_metadata(root="."):
-    """Get the project metatdata from the `kitspace.yaml` file.
+class KicadProject:
+    """A KiCad project (i.e., a directory containing a `*.pro` file).
     """
-    root = _set_root(root)
+    def __init__(self, root):
+        self.root = root
+        self.name = os.path.splitext(os.path.split(glob.glob(os.path.join(root, "*.pro"))[0])[1])[0]
+        self.schematic_path = os.path.join(root, self.name + ".sch")
+        self.board_path = os.path.join(root, self.name + ".kicad_pcb")
+        self.bom_path = os.path.join(root, "manufacturing", "default", self.name + "-BOM.csv")
+        self._stamp = _stamp(root)
+        self._cache = {}
 
-    # Default metadata if there's no existing `kitspace.yaml` file.
-    metadata = {"summary": "A description for your project",
-                "site": "https://example.com # A site you would like to link to (include http:// or https://)",
-                "color": "black"
-    }
+    def __repr__(self):
+        return f"KicadProject({ self.root !r})"
 
-    try:
-        # If there's an existing `kicad.yaml` file, those settings override the defaults.
-        with open(os.path.join(root, "kitspace.yaml")) as f:
-            metadata.update({k: v for k, v in load(f, Loader=Loader).items() if k in ["summary", "site", "color"]})
-    except FileNotFoundError:
-        pass
+    def _cached(self, key, path, load):
+        """Return `load()`, reusing the previous result until `path` changes.
+        """
+        stamp = _stamp(path)
+        if key not in self._cache or self._cache[key][0] != stamp:
+            self._cache[key] = (stamp, load())
+        return self._cache[key][1]
 
-    # Add the project name
-    metadata["project_name"]=get_project_name(root)
-    return metadata
+    @property
+    def metadata(self):
+        """Project metadata from the `kitspace.yaml` file.
+        """
+        return self._cached("metadata", os.path.join(self.root, "kitspace.yaml"), self._load_metadata)
 
+    def _load_metadata(self):
+        # Default metadata if there's no existing `kitspace.yaml` file.
+        metadata = {"summary": "A description for your project",
+                    "site": "https://example.com # A site you would like to link to (include http:// or https://)",
+                    "color": "black"
+        }
+
+        try:
+            # If there's an existing `kicad.yaml` file, those settings override the defaults.
+            with open(os.path.join(self.root, "kitspace.yaml")) as f:
+                metadata.update({k: v for k, v in load(f, Loader=Loader).items() if k in ["summary", "site", "color"]})
+        except FileNotFoundError:
+            pass
+
+        # Add the project name
+        metadata["project_name"] = self.name
+        return metadata
+
+    @property
+    def manufacturers(self):
+        """Manufacturers with a KiBot config in `.kicad_helpers_config/manufacturers`.
+        """
+        path = os.path.join(self.root, ".kicad_helpers_config", "manufacturers")
+        return self._cached("manufacturers", path,
+            lambda: [os.path.split(f)[1][:-5] for f in glob.glob(os.path.join(path, "*.yaml"))])
+
+# Cell
+_projects = {}
+
+def get_project(root="."):
+    """Get the `KicadProject` for `root`. Projects are cached per root
+    directory, so repeated calls are cheap.
+    """
+    if isinstance(root, KicadProject):
+        return root
+    root = _set_root(root)
+    project = _projects.get(root)
+    if project is None or project._stamp != _stamp(root):
+        project = _projects[root] = KicadProject(root)
+    return project
+
+# Cell
+def get_project_name(root="."):
+    """Get the project name based on the name of the KiCad `*.pro` file.
+    """
+    return get_project(root).name
+
+# Cell
+def get_project_metadata(root="."):
+    """Get the project metatdata from the `kitspace.yaml` file.
+    """
+    return dict(get_project(root).metadata)
 
 # Cell
 def get_schematic_path(root="."):
     """Get the path to the KiCad schematic.
     """
-    root = _set_root(root)
-    return os.path.join(root, get_project_name(root) + ".sch")
+    return get_project(root).schematic_path
 
 # Cell
 def get_bom_path(root="."):
     """Get the path to the BOM.
     """
-    root = _set_root(root)
-    return os.path.join(root, "manufacturing", "default", get_project_name(root) + "-BOM.csv")
+    return get_project(root).bom_path
 
 # Cell
 def get_board_path(root="."):
     """Get the path to the KiCad board file.
     """
-    root = _set_root(root)
-    return os.path.join(root, get_project_name(root) + ".kicad_pcb")
+    return get_project(root).board_path
 
 # Cell
 def get_manufacturers(root="."):
     """Get the supported manufacturers.
     """
+    return list(get_project(root).manufacturers)
+
+# Cell
+def _gitignore_regex(pattern):
+    """Translate a gitignore glob (without the leading "!" or trailing "/")
+    into a regular expression.
+    """
+    out = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        leading = i == 0 or pattern[i - 1] == "/"
+        if leading and pattern.startswith("**/", i):
+            out += "(?:.*/)?"
+            i += 3
+        elif leading and pattern[i:] == "**":
+            out += ".*"
+            i += 2
+        elif c == "*":
+            out += "[^/]*"
+            i += 1
+        elif c == "?":
+            out += "[^/]"
+            i += 1
+        elif c == "[" and pattern.find("]", i + 2) != -1:
+            j = pattern.find("]", i + 2)
+            body = pattern[i + 1:j]
+            if body[0] in "!^":
+                body = "^" + body[1:]
+            out += "[" + body.replace("\\", "\\\\") + "]"
+            i = j + 1
+        elif c == "\\" and i + 1 < len(pattern):
+            out += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            out += re.escape(c)
+            i += 1
+    return out
+
+class GitignoreMatcher:
+    """Match paths against the `.gitignore` files in a project (including
+    those in subdirectories) and `.git/info/exclude`, without running git.
+    Ignore files are parsed when they are first needed and re-parsed when
+    they change.
+    """
+    def __init__(self, root):
+        self.root = root
+        self._files = {}
+
+    def _read(self, path):
+        stamp = _stamp(path)
+        if path not in self._files or self._files[path][0] != stamp:
+            lines = []
+            if stamp is not None:
+                with open(path) as f:
+                    lines = [line.rstrip("\n") for line in f]
+            self._files[path] = (stamp, lines, None)
+        return self._files[path]
+
+    def lines(self, directory=""):
+        """Get the lines of the `.gitignore` file in `directory` (relative to
+        the project root).
+        """
+        return self._read(os.path.join(self.root, directory, ".gitignore"))[1]
+
+    def _patterns(self, path, base):
+        stamp, lines, patterns = self._read(path)
+        if patterns is None:
+            patterns = []
+            prefix = re.escape(base + "/") if base else ""
+            for line in lines:
+                pattern = line.rstrip(" ")
+                if pattern.endswith("\\") and len(pattern) < len(line):
+                    pattern += " "
+                if not pattern or pattern.startswith("#"):
+                    continue
+                negate = pattern.startswith("!")
+                if negate:
+                    pattern = pattern[1:]
+                dir_only = pattern.endswith("/")
+                pattern = pattern.rstrip("/")
+                anchored = "/" in pattern
+                regex = _gitignore_regex(pattern.lstrip("/"))
+                regex = f"^{ prefix }{ '' if anchored else '(?:.*/)?' }{ regex }$"
+                patterns.append((re.compile(regex, re.DOTALL), negate, dir_only))
+            self._files[path] = (stamp, lines, patterns)
+        return patterns
+
+    def _ignored(self, path, is_dir, directories):
+        ignored = False
+        ignore_files = [(os.path.join(self.root, ".git", "info", "exclude"), "")]
+        ignore_files += [(os.path.join(self.root, *directory.split("/"), ".gitignore"), directory)
+                         for directory in directories]
+        for ignore_file, base in ignore_files:
+            for regex, negate, dir_only in self._patterns(ignore_file, base):
+                if (is_dir or not dir_only) and regex.match(path):
+                    ignored = not negate
+        return ignored
+
+    def match(self, path, is_dir=None):
+        """Return `True` if `path` (relative to the project root) is ignored.
+        """
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.root)
+        path = path.replace(os.sep, "/").strip("/")
+        if is_dir is None:
+            is_dir = os.path.isdir(os.path.join(self.root, path))
+        parts = path.split("/")
+        directories = [""]
+        for i in range(1, len(parts) + 1):
+            # Files in an ignored directory are ignored
+            if self._ignored("/".join(parts[:i]), i < len(parts) or is_dir, directories):
+                return True
+            directories.append("/".join(parts[:i]))
+        return False
+
+# Cell
+_gitignore_matchers = {}
+
+def get_gitignore_matcher(root="."):
+    """Get the (cached) `GitignoreMatcher` for the project in `root`."""
     root = _set_root(root)
-    return [os.path.split(f)[1][:-5] for f in glob.glob(os.path.join(root, ".kicad_helpers_config", "manufacturers", "*.yaml"))]
+    if root not in _gitignore_matchers:
+        _gitignore_matchers[root] = GitignoreMatcher(root)
+    return _gitignore_matchers[root]
 
 # Cell
 def get_gitignore_list(root="."):
-    root =_set_root(root)
-    with open(f"{ root }/.gitignore") as f:
-        gitignore = f.readlines()
-    return [line.strip() for line in gitignore]
+    return [line.strip() for line in get_gitignore_matcher(root).lines()]
 
 # Cell
 def in_gitignore(filename, root="."):
-    root = _set_root(root)
+    """Return `True` if `filename` is ignored by the project's `.gitignore`
+    files (see `GitignoreMatcher`).
+    """
+    return get_gitignore_matcher(root).match(filename)
+
+# Cell
+def _docker():
+    """The docker executable, which can be overridden with the `KH_DOCKER`
+    environment variable (e.g., to use a stand-in for testing).
+    """
+    return os.getenv("KH_DOCKER", "docker")
+
+_docker_containers = {}
+_docker_containers_lock = threading.Lock()
+
+def _get_docker_container(workdir, container, v=False):
+    """Get the name of a long-running `container` with `workdir` mounted at
+    `/workdir`, starting it (and creating a user mapped to the current UID)
+    if it isn't already running.
+    """
+    with _docker_containers_lock:
+        if (workdir, container) not in _docker_containers:
+            _docker_containers[(workdir, container)] = _start_docker_container(workdir, container, v=v)
+        return _docker_containers[(workdir, container)]
+
+def _start_docker_container(workdir, container, v=False):
+    docker = _docker()
+    name = "kicad_helpers-" + hashlib.sha1(f"{ workdir }:{ container }".encode("utf-8")).hexdigest()[:12]
     try:
-        cmd = f"cd { root } && git check-ignore --no-index { filename }"
-        if len(_run_cmd(cmd)):
-            return True
+        running = subprocess.check_output([docker, "inspect", "-f", "{{.State.Running}}", name],
+                                          stderr=subprocess.DEVNULL).decode("utf-8").strip() == "true"
     except subprocess.CalledProcessError:
-        pass
-    return False
+        running = False
+
+    if not running:
+        if v:
+            print(f"Start { container } container { name }")
+        with trace_span("start container", "docker", container=container):
+            subprocess.run([docker, "rm", "-f", name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            subprocess.check_output([docker, "run", "-d", "--rm", "--name", name, "--label", "kicad_helpers",
+                                     "-v", f"{ workdir }:/workdir", "--workdir=/workdir", container,
+                                     "sleep", "infinity"], stderr=subprocess.STDOUT)
+            subprocess.check_output([docker, "exec", name, "useradd", "--shell", "/bin/bash",
+                                     "-u", str(os.getuid()), "-o", "-c", "", "-m", "docker"],
+                                    stderr=subprocess.STDOUT)
+    return name
 
 # Cell
+_docker_slots = None
+
+async def run_docker_cmd_async(cmd,
+                               workdir,
+                               container,
+                               v=False,
+                               timeout=None,
+                               on_line=None):
+    """Asynchronous version of `run_docker_cmd`, e.g., to run several
+    commands concurrently from one event loop.
+    """
+    acquired = False
+    try:
+        if _docker_slots is not None:
+            # Poll for a slot (rather than blocking in a thread), so that a
+            # task that's cancelled while waiting can't end up holding one
+            while not _docker_slots.acquire(False):
+                await asyncio.sleep(0.05)
+            acquired = True
+        args = ["/bin/bash", "-c", cmd] if isinstance(cmd, str) else list(cmd)
+        job = uuid.uuid4().hex[:12]
+        if os.getenv("KH_DOCKER_POOL", "1") == "0":
+            name = f"kicad_helpers-job-{ job }"
+            docker_cmd = [_docker(), "run", "--rm", "--name", name, "-v", f"{ workdir }:/workdir", "--workdir=/workdir",
+                          container, "/bin/bash", "-c",
+                          f"useradd --shell /bin/bash -u { os.getuid() } -o -c '' -m docker && "
+                          f"exec runuser docker -c { shlex.quote(' '.join(shlex.quote(arg) for arg in args)) }"]
+            kill = [_docker(), "rm", "-f", name]
+        else:
+            name = await _run_in_thread(_get_docker_container, workdir, container, v)
+            # Run the command in a new session and record its process group,
+            # so that it (and any processes it starts) can be stopped.
+            pid_path = f"/tmp/kicad_helpers-{ job }.pid"
+            docker_cmd = [_docker(), "exec", "--user", "docker", "--env", "HOME=/home/docker", name,
+                          "setsid", "--wait", "/bin/bash", "-c", 'echo $$ > "$0" && exec "$@"', pid_path] + args
+            kill = [_docker(), "exec", name, "/bin/bash", "-c", 'kill -TERM -- -$(cat "$0")', pid_path]
+        if v:
+            print(" ".join(shlex.quote(arg) for arg in docker_cmd))
+        with trace_span("run_docker_cmd", "docker", cmd=cmd, container=container):
+            return await run_cmd_async(docker_cmd, timeout=timeout, on_line=on_line, kill=kill)
+    finally:
+        if acquired:
+            _docker_slots.release()
+
 def run_docker_cmd(cmd,
                    workdir,
                    container,
-                   v=False):
+                   v=False,
+                   timeout=None,
+                   on_line=None):
     """
     Run a command in a docker container under a UID mapped to the current user.
     This ensures that the current user is owner of any files created in the
     workdir.
+
+    `cmd` is either a list of arguments (which isn't interpreted by a shell)
+    or a command line for `bash`. Each line of output is passed to
+    `on_line(line, stream)` as soon as it's read, and the command is stopped
+    if it doesn't finish within `timeout` seconds (see `run_cmd_async`).
+
+    Commands are run with `docker exec` in a long-running container (one per
+    `workdir` and `container` image), so the container startup and user
+    creation only happen the first time. Use `kh docker_stop` to remove
+    these containers, or set the `KH_DOCKER_POOL` environment variable to
+    "0" to run each command in a new container.
+
+    If `_docker_slots` is set (e.g., to a semaphore shared by a pool of
+    processes), it is held while the command runs.
     """
-    UID = subprocess.check_output("id -u", shell=True).decode("utf-8").strip()
-    docker_cmd = (f"docker run --rm -v { workdir }:/workdir --workdir=\"/workdir\" "
-        f"{ container } "
-        f"/bin/bash -c \"useradd --shell /bin/bash -u { UID } -o -c '' -m docker && "
-        f"runuser docker -c '{ cmd }'\""
-    )
-    if v:
-        print(docker_cmd)
-    return subprocess.check_output(docker_cmd, stderr=subprocess.STDOUT, shell=True)
+    return _run_sync(run_docker_cmd_async(cmd, workdir, container, v=v, timeout=timeout, on_line=on_line))
+
+# Cell
+@profiled
+@call_parse
+def stop_docker_containers(v:Param("verbose", bool)=False):
+    """Stop and remove the long-running containers started by
+    `run_docker_cmd`.
+    """
+    docker = _docker()
+    names = subprocess.check_output([docker, "ps", "-q", "--filter", "label=kicad_helpers"]).decode("utf-8").split()
+    if names:
+        if v:
+            print(f"Remove { len(names) } container{ '' if len(names) == 1 else 's' }")
+        subprocess.check_output([docker, "rm", "-f"] + names, stderr=subprocess.STDOUT)
+    _docker_containers.clear()
 
 # Cell
 def run_kibot_docker(config:Param(f"KiBot configuation file", str),
                      root:Param("project root directory", str)=".",
                      v:Param("verbose", bool)=False,
-                     output:Param("output path relative to ROOT")="."):
+                     output:Param("output path relative to ROOT")=".",
+                     cache:Param("restore outputs from (and save them to) the output cache", bool)=False,
+                     timeout:Param("seconds to wait for KiBot before stopping it", float)=None):
     """
-    Run KiBot in a local docker container.
+    Run KiBot in a local docker container. If `v` is set, its output is
+    printed as it runs.
     """
-    root = _set_root(root)
+    project = get_project(root)
+    root = project.root
     if os.path.abspath(output) == output:
         raise RuntimeError(f"OUTPUT cannot be an absolute path; it must be relative to ROOT={ root }.")
 
-    cmd = (f"kibot -c { config } "
-       f"-e { get_schematic_path(root)[len(root) + 1:] } "
-       f"-b { get_board_path(root)[len(root) + 1:] } "
-       f"-d { output }"
-    )
-    run_docker_cmd(cmd,
-                   workdir=os.path.abspath(root),
-                   container="setsoft/kicad_auto_test:latest",
-                   v=v
+    container = "setsoft/kicad_auto_test:latest"
+    cmd = ["kibot", "-c", config,
+           "-e", project.schematic_path[len(root) + 1:],
+           "-b", project.board_path[len(root) + 1:],
+           "-d", output]
+    run = lambda: run_docker_cmd(cmd,
+                                 workdir=os.path.abspath(root),
+                                 container=container,
+                                 v=v,
+                                 timeout=timeout,
+                                 on_line=_print_line if v else None
     )
+    if not cache:
+        return run()
+    # Only store the files in the config's output directories
+    with open(os.path.join(root, config)) as f:
+        dirs = _kibot_output_dirs(load(f, Loader=Loader))
+    return _run_with_output_cache(lambda: _output_cache_key(config, project, container),
+                                  os.path.join(root, output), run, v=v, dirs=dirs)[0]
+
+# Cell
+_fake_kibot = textwrap.dedent("""\
+    import os, sys, yaml
+    config = yaml.safe_load(open(sys.argv[sys.argv.index("-c") + 1]))
+    output = sys.argv[sys.argv.index("-d") + 1]
+    with open("kibot.log", "a") as log:
+        for out in config.get("outputs") or []:
+            os.makedirs(os.path.join(output, out["dir"]), exist_ok=True)
+            with open(os.path.join(output, out["dir"], out["type"] + ".txt"), "w") as f:
+                f.write(out["name"])
+            log.write(out["type"] + "\\n")
+            print(f"- '{ out.get('comment', '') }' ({ out['name'] }) [{ out['type'] }]")
+    """)
+
+@contextlib.contextmanager
+def _fake_docker(workdir, commands=None, digest="sha256:1234"):
+    """Use a stand-in for docker (see `_docker`) for testing. Images report
+    `digest`, and commands run in a container are run locally in `workdir`
+    with a stand-in for KiBot (which writes an `<type>.txt` file for each
+    output and logs the types to `kibot.log`) and any other `commands` (a
+    dictionary mapping names to python scripts) on the `PATH`.
+
+    Yields the directory containing the scripts, which also holds the cache
+    directory (see `KH_CACHE_DIR`).
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        docker = textwrap.dedent(f"""\
+            import os, subprocess, sys
+            if sys.argv[1] == "image":
+                print({ digest !r})
+            elif sys.argv[1] == "exec" and "setsid" in sys.argv:
+                # Run the arguments after `setsid --wait /bin/bash -c SCRIPT PID_PATH`
+                args = sys.argv[sys.argv.index("setsid") + 6:]
+                env = dict(os.environ, PATH={ tmp !r} + os.pathsep + os.environ["PATH"])
+                sys.exit(subprocess.call(args, cwd={ workdir !r}, env=env))
+            """)
+        for name, source in {"kibot": _fake_kibot, **(commands or {}), "docker": docker}.items():
+            with open(os.path.join(tmp, name), "w") as f:
+                f.write(f"#!{ sys.executable }\n{ source }")
+            os.chmod(os.path.join(tmp, name), 0o755)
+        env = {name: os.getenv(name) for name in ["KH_DOCKER", "KH_CACHE_DIR"]}
+        os.environ.update(KH_DOCKER=os.path.join(tmp, "docker"), KH_CACHE_DIR=os.path.join(tmp, "cache"))
+        try:
+            yield tmp
+        finally:
+            for name, value in env.items():
+                if value is None:
+                    del os.environ[name]
+                else:
+                    os.environ[name] = value
 
 # Cell
+_sexpr_token = re.compile(rb'\s*(?:(\()|(\))|("(?:[^"\\]|\\.)*")|([^\s()"]+))')
+
+def _sexpr_tokens(f, chunk_size=1 << 16):
+    """Yield `(token, start, end)` tuples from the binary file object `f`,
+    where `token` is `b"("`, `b")"` or an atom (the raw bytes, including
+    any quotes) and `start`/`end` are byte offsets into the file.
+    """
+    buf = b""
+    offset = 0 # file offset of `buf[0]`
+    pos = 0
+    eof = False
+    while True:
+        m = _sexpr_token.match(buf, pos)
+        # A token that runs to the end of the buffer may continue in the
+        # next chunk, so read more before accepting it.
+        if m is None or (m.end() == len(buf) and not eof):
+            if eof:
+                if buf[pos:].strip():
+                    raise ValueError(f"Invalid S-expression at byte { offset + pos }.")
+                return
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            offset += pos
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        pos = m.end()
+        yield m.group(m.lastindex), offset + m.start(m.lastindex), offset + pos
+
+# Cell
+class SexprAtom(str):
+    """An S-expression atom (e.g., `rev` or `"My board"`, including quotes)
+    along with the `start` and `end` byte offsets where it was found.
+    """
+    def __new__(cls, value, start=None, end=None):
+        atom = super().__new__(cls, value)
+        atom.start, atom.end = start, end
+        return atom
+
+
+class SexprNode:
+    """An S-expression list, e.g. `(title_block (title "My board") ...)`.
+
+    `name` is the first atom, `items` holds the remaining atoms and child
+    nodes, and `start`/`end` are the byte offsets of the opening and
+    closing parentheses (`end` is exclusive).
+    """
+    def __init__(self, name, start):
+        self.name = name
+        self.items = []
+        self.start = start
+        self.end = None
+
+    def __repr__(self):
+        return f"SexprNode({ self.name !r}, { len(self.items) } items)"
+
+    @property
+    def values(self):
+        """The atoms (excluding the name) of this node."""
+        return [item for item in self.items if isinstance(item, SexprAtom)]
+
+    @property
+    def children(self):
+        """The child nodes of this node."""
+        return [item for item in self.items if isinstance(item, SexprNode)]
+
+    def find(self, path):
+        """Return the first descendant matching `path` (child names separated
+        by "/", e.g. `"title_block/title"`) or `None`.
+        """
+        node = self
+        for name in path.split("/"):
+            node = next((child for child in node.children if child.name == name), None)
+            if node is None:
+                break
+        return node
+
+    __getitem__ = find
+
+
+def _parse_sexpr(tokens, start, name=None):
+    """Build a `SexprNode` from `tokens`, starting just after the opening
+    parenthesis at byte offset `start` (and after the node's `name`, if it
+    has already been read).
+    """
+    node = None if name is None else SexprNode(name, start)
+    for token, tstart, tend in tokens:
+        if token == b"(":
+            if node is None:
+                raise ValueError(f"Unnamed S-expression at byte { start }.")
+            node.items.append(_parse_sexpr(tokens, tstart))
+        elif token == b")":
+            if node is None:
+                raise ValueError(f"Empty S-expression at byte { start }.")
+            node.end = tend
+            return node
+        else:
+            atom = SexprAtom(token.decode("utf-8"), tstart, tend)
+            if node is None:
+                node = SexprNode(atom, start)
+            else:
+                node.items.append(atom)
+    raise ValueError("Unexpected end of S-expression.")
+
+# Cell
+def parse_sexpr(f):
+    """Parse the S-expression in `f` (a path or binary file object) into a
+    tree of `SexprNode`s.
+    """
+    if isinstance(f, (str, os.PathLike)):
+        with open(f, "rb") as f:
+            return parse_sexpr(f)
+    tokens = _sexpr_tokens(f)
+    for token, start, end in tokens:
+        if token != b"(":
+            raise ValueError(f"Expected \"(\" at byte { start }.")
+        return _parse_sexpr(tokens, start)
+
+# Cell
+def find_sexpr(f, path, stop_at=()):
+    """Find the first node matching `path` (node names from the top level,
+    separated by "/", e.g. `"kicad_pcb/title_block"`) in `f` (a path or
+    binary file object).
+
+    Only the matching node is built; everything else is skipped and reading
+    stops as soon as the node has been parsed, or when a sibling named in
+    `stop_at` is reached (in which case `None` is returned).
+    """
+    if isinstance(f, (str, os.PathLike)):
+        with trace_span("find_sexpr", "parse", path=f, node=path), open(f, "rb") as f:
+            return find_sexpr(f, path, stop_at)
+    names = path.split("/")
+    tokens = _sexpr_tokens(f)
+    stack = [] # names of the open lists
+    pending = None # offset of the last "(" if its name hasn't been read yet
+    for token, start, end in tokens:
+        if token == b"(":
+            stack.append(None)
+            pending = start
+        elif token == b")":
+            stack.pop()
+            pending = None
+        elif pending is not None:
+            name = SexprAtom(token.decode("utf-8"), start, end)
+            depth = len(stack)
+            if depth <= len(names) and stack[:depth - 1] == names[:depth - 1]:
+                if name == names[depth - 1]:
+                    if depth == len(names):
+                        return _parse_sexpr(tokens, pending, name)
+                elif depth == len(names) and name in stop_at:
+                    return None
+            stack[-1] = name
+            pending = None
+    return None
+
+# Cell
+_board_header_end = ("layers", "setup", "net", "net_class", "module", "footprint")
+
 def get_board_metadata(root="."):
     """Get metadata from the `*.kicad_pcb` board file.
     """
-    root = _set_root(root)
-    with open(get_board_path(root), 'r') as f:
-        board = f.read()
-    matches = re.search("\(title_block.*title (?P<title>[^\)]*)\)"
-        ".*date (?P<date>[^\)]*)\)"
-        ".*rev (?P<rev>[^\)]*)\)"
-        ".*company (?P<company>[^\)]*)\)",
-        board, re.DOTALL
-    )
-    return matches.groupdict()
+    title_block = find_sexpr(get_board_path(root), "kicad_pcb/title_block",
+                             stop_at=_board_header_end)
+    metadata = {}
+    if title_block is not None:
+        for key in ["title", "date", "rev", "company"]:
+            node = title_block.find(key)
+            if node is not None:
+                metadata[key] = " ".join(node.values)
+    return metadata
+
+# Cell
+def _splice_file(path, edits):
+    """Replace byte ranges in the file at `path`, where `edits` is a list of
+    non-overlapping `(start, end, data)` tuples.
+
+    If no edit changes the length of the file, the bytes are overwritten in
+    place. Otherwise the file is copied (in chunks) to a temporary file with
+    the edits applied, which then atomically replaces the original.
+    """
+    with trace_span("_splice_file", "io", path=path):
+        _splice(path, sorted(edits, key=lambda edit: edit[0]))
+
+def _splice(path, edits):
+    if all(end - start == len(data) for start, end, data in edits):
+        with open(path, "r+b") as f:
+            for start, end, data in edits:
+                f.seek(start)
+                f.write(data)
+        return
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+            pos = 0
+            for start, end, data in edits:
+                dst.write(src.read(start - pos))
+                dst.write(data)
+                src.seek(end)
+                pos = end
+            shutil.copyfileobj(src, dst, 1 << 20)
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 # Cell
 def update_board_metadata(update_dict, root="."):
     """Update metadata in the `*.kicad_pcb` board file.
+
+    Only the header of the board is parsed, and only the values that change
+    are rewritten (see `_splice_file`). Missing fields are added to the end
+    of the `title_block`.
     """
-    root = _set_root(root)
-    with open(get_board_path(root), 'r') as f:
-        board = f.read()
+    path = get_board_path(root)
+    title_block = find_sexpr(path, "kicad_pcb/title_block", stop_at=_board_header_end)
+    if title_block is None:
+        raise RuntimeError(f"No title_block found in { path }.")
 
+    # New fields go on their own line after the last field (or after the
+    # `title_block` name if there are no fields).
+    with open(path, "rb") as f:
+        f.seek(title_block.start)
+        raw = f.read(title_block.end - title_block.start)
+    children = title_block.children
+    if children:
+        insert_at = children[-1].end
+        line_start = raw.rfind(b"\n", 0, children[-1].start - title_block.start) + 1
+        indent = raw[line_start:children[-1].start - title_block.start]
+        sep = b"\n" + indent if line_start and not indent.strip() else b" "
+    else:
+        insert_at = title_block.name.end
+        sep = b" "
+
+    edits = []
     for key, value in update_dict.items():
         if " " in value and not value.startswith('\"') and not value.endswith('\"'):
             value = '\"' + value + '\"'
-        board, n = re.subn(f"(?s)(?P<pre>\(title_block.*{ key } )[^\)]*\)",
-            f"\g<pre>{ value })",
-            board
-        )
-        assert n == 1
-    with open(get_board_path(root), 'w') as f:
-        f.write(board)
+        node = title_block.find(key)
+        if node is None:
+            edits.append((insert_at, insert_at, sep + f"({ key } { value })".encode("utf-8")))
+        elif not node.values:
+            edits.append((node.name.end, node.name.end, f" { value }".encode("utf-8")))
+        elif " ".join(node.values) != value:
+            edits.append((node.values[0].start, node.values[-1].end, value.encode("utf-8")))
+    if edits:
+        _splice_file(path, edits)
+
+# Cell
+_sch_token = re.compile(r'"(?:[^"\\]|\\.)*"|\S+')
+_sch_field_names = {"0": "reference", "1": "value", "2": "footprint", "3": "datasheet"}
+
+def _sch_unquote(token):
+    if len(token) > 1 and token.startswith('"') and token.endswith('"'):
+        return token[1:-1].replace('\\"', '"')
+    return token
+
+def _sch_quote(value):
+    return '"' + value.replace('"', '\\"') + '"'
+
+def _eol(line):
+    return line[len(line.rstrip("\r\n")):]
+
+# Cell
+class SchematicComponent:
+    """A component (`$Comp` ... `$EndComp`) in a schematic.
+
+    `fields` maps field names (e.g., "reference", "value", "footprint",
+    "datasheet", "MPN") to their (unquoted) values and `field_lines` maps
+    them to line numbers in the schematic. `instances` maps hierarchical
+    sheet paths to the reference used for that instance of the sheet.
+    """
+    def __init__(self, lines, start, end):
+        self.start, self.end = start, end
+        self.lib_id = self.ref = self.timestamp = self.position = None
+        self.fields = {}
+        self.field_lines = {}
+        self.instances = {}
+        for i in range(start + 1, end):
+            tokens = _sch_token.findall(lines[i])
+            if not tokens or lines[i].startswith("\t"):
+                continue
+            if tokens[0] == "L":
+                self.lib_id, self.ref = tokens[1:3]
+            elif tokens[0] == "U":
+                self.timestamp = tokens[3]
+            elif tokens[0] == "P":
+                self.position = tuple(tokens[1:3])
+            elif tokens[0] == "AR":
+                attrs = dict(token.split("=", 1) for token in tokens[1:] if "=" in token)
+                self.instances[_sch_unquote(attrs["Path"])] = _sch_unquote(attrs["Ref"])
+            elif tokens[0] == "F":
+                name = _sch_field_names.get(tokens[1])
+                if name is None:
+                    name = _sch_unquote(tokens[10]) if len(tokens) > 10 else f"F{ tokens[1] }"
+                self.fields[name] = _sch_unquote(tokens[2])
+                self.field_lines[name] = i
+
+    def __repr__(self):
+        return f"SchematicComponent({ self.ref !r})"
+
+    @property
+    def refs(self):
+        """All references used by this component (across sheet instances)."""
+        return {self.ref} | set(self.instances.values())
+
+
+class SchematicSheet:
+    """A hierarchical sheet (`$Sheet` ... `$EndSheet`) in a schematic.
+    """
+    def __init__(self, lines, start, end):
+        self.start, self.end = start, end
+        self.name = self.filename = self.timestamp = None
+        for i in range(start + 1, end):
+            tokens = _sch_token.findall(lines[i])
+            if not tokens:
+                continue
+            if tokens[0] == "U":
+                self.timestamp = tokens[1]
+            elif tokens[0] == "F0":
+                self.name = _sch_unquote(tokens[1])
+            elif tokens[0] == "F1":
+                self.filename = _sch_unquote(tokens[1])
+
+    def __repr__(self):
+        return f"SchematicSheet({ self.name !r}, { self.filename !r})"
+
+# Cell
+class Schematic:
+    """A KiCad (v5) `*.sch` schematic file.
+
+    `title_block` maps title block keys (e.g., "Title", "Date", "Rev",
+    "Comp") to their raw (quoted) values. Changes made with
+    `set_title_field` or `set_component_fields` only edit the affected
+    lines, and are written to disk by `save`.
+    """
+    def __init__(self, path):
+        self.path = path
+        with trace_span("read schematic", "parse", path=path):
+            with open(path, encoding="utf-8", newline="") as f:
+                self.lines = f.readlines()
+            self._stamp = _stamp(path)
+            self._parse()
+
+    def __repr__(self):
+        return f"Schematic({ self.path !r})"
+
+    def _parse(self):
+        self.title_block = {}
+        self.title_lines = {}
+        self.components = []
+        self.sheets = []
+        lines = self.lines
+        block, start = None, None
+        for i, line in enumerate(lines):
+            if block is None:
+                if line.startswith(("$Descr", "$Comp", "$Sheet")):
+                    block, start = line.split()[0], i
+            elif line.startswith("$End"):
+                if block == "$Comp":
+                    self.components.append(SchematicComponent(lines, start, i))
+                elif block == "$Sheet":
+                    self.sheets.append(SchematicSheet(lines, start, i))
+                block = None
+            elif block == "$Descr":
+                key, _, value = line.rstrip("\r\n").partition(" ")
+                if key in ("Title", "Date", "Rev", "Comp") or key.startswith("Comment"):
+                    self.title_block[key] = value
+                    self.title_lines[key] = i
+
+    def set_title_field(self, key, value):
+        """Set a (raw) title block value. Returns `True` if it changed.
+        """
+        if key not in self.title_block:
+            raise RuntimeError(f"{ key } is not in the title block of { self.path }.")
+        if self.title_block[key] == value:
+            return False
+        i = self.title_lines[key]
+        self.lines[i] = f"{ key } { value }" + _eol(self.lines[i])
+        self.title_block[key] = value
+        return True
+
+    def _insert_line(self, i, line):
+        """Insert `line` before line `i`, keeping the line numbers of
+        components and sheets up to date.
+        """
+        self.lines.insert(i, line)
+        for item in self.components + self.sheets:
+            item.start += item.start >= i
+            item.end += item.end >= i
+            if isinstance(item, SchematicComponent):
+                item.field_lines = {name: j + (j >= i) for name, j in item.field_lines.items()}
+
+    def set_component_fields(self, component, fields):
+        """Set `fields` (a dictionary of field names and unquoted values) on
+        `component`, adding any fields it doesn't have yet. Returns a list
+        of `(name, old_value, new_value)` tuples for the fields that changed
+        (`old_value` is `None` for new fields).
+        """
+        changes = []
+        for name, value in fields.items():
+            old_value = component.fields.get(name)
+            if old_value == value or name == "reference":
+                continue
+            if name in component.fields:
+                i = component.field_lines[name]
+                line = self.lines[i]
+                token = list(_sch_token.finditer(line))[2]
+                self.lines[i] = line[:token.start()] + _sch_quote(value) + line[token.end():]
+            else:
+                # New fields are hidden and placed at the component's position
+                i = max(component.field_lines.values()) + 1
+                x, y = component.position
+                self._insert_line(i, f"F { len(component.fields) } { _sch_quote(value) } H { x } { y } 50  0001 C CNN "
+                                     f"{ _sch_quote(name) }" + _eol(self.lines[i - 1]))
+                component.field_lines[name] = i
+            component.fields[name] = value
+            changes.append((name, old_value, value))
+        return changes
+
+    def save(self):
+        """Write the schematic back to disk.
+        """
+        with trace_span("write schematic", "io", path=self.path), \
+             open(self.path, "w", encoding="utf-8", newline="") as f:
+            f.writelines(self.lines)
+        self._parse()
+        self._stamp = _stamp(self.path)
+
+# Cell
+_schematics = {}
+
+def get_schematic(path):
+    """Get the `Schematic` at `path`. Parsed schematics are cached until the
+    file changes.
+    """
+    path = os.path.normpath(path)
+    schematic = _schematics.get(path)
+    if schematic is None or schematic._stamp != _stamp(path):
+        schematic = _schematics[path] = Schematic(path)
+    return schematic
+
+# Cell
+def get_sheet_instances(root="."):
+    """Get a list of `(sheet_path, schematic)` tuples for every sheet
+    instance in the project's hierarchy, starting with the root sheet (whose
+    path is ""). A schematic file used by several sheets appears once per
+    instance.
+    """
+    instances = []
+    todo = [("", get_schematic(get_schematic_path(root)))]
+    while todo:
+        sheet_path, schematic = todo.pop(0)
+        instances.append((sheet_path, schematic))
+        if sheet_path.count("/") > 100:
+            raise RuntimeError(f"Recursive sheet hierarchy in { schematic.path }.")
+        for sheet in schematic.sheets:
+            todo.append((f"{ sheet_path }/{ sheet.timestamp }",
+                         get_schematic(os.path.join(os.path.dirname(schematic.path), sheet.filename))))
+    return instances
+
+def get_schematic_hierarchy(root="."):
+    """Get the `Schematic`s in the project's hierarchy (each file once),
+    starting with the root sheet.
+    """
+    schematics = []
+    for sheet_path, schematic in get_sheet_instances(root):
+        if schematic not in schematics:
+            schematics.append(schematic)
+    return schematics
+
+# Cell
+def get_schematic_components(root="."):
+    """Get a dictionary mapping each reference in the project's hierarchy to
+    a list of `(schematic, component)` tuples (one for each unit).
+    Power symbols and unannotated components are skipped.
+    """
+    components = {}
+    for sheet_path, schematic in get_sheet_instances(root):
+        for component in schematic.components:
+            ref = component.instances.get(f"{ sheet_path }/{ component.timestamp }", component.ref)
+            if ref.startswith("#") or ref.endswith("?"):
+                continue
+            components.setdefault(ref, []).append((schematic, component))
+    return components
 
 # Cell
 def get_schematic_metadata(root, filename=None):
     """Get metadata from a `*.sch` schematic file.
     """
+    root = _set_root(root)
     if filename is None:
         filename = get_schematic_path(root)
     elif os.path.abspath(filename) != filename:
         filename = os.path.join(root, filename)
 
-    with open(filename, 'r') as f:
-        schematic = f.read()
-
-    matches = re.search("Title (?P<Title>[^\n]*)\n"
-        ".*Date (?P<Date>[^\n]*)\n"
-        ".*Rev (?P<Rev>[^\n]*)\n"
-        ".*Comp (?P<Comp>[^\n]*)\n",
-        schematic, re.DOTALL
-    )
-
-    return matches.groupdict()
+    title_block = get_schematic(filename).title_block
+    return {key: title_block[key] for key in ["Title", "Date", "Rev", "Comp"]}
 
 # Cell
 def update_schematic_metadata(update_dict:dict,      # keys/values to update
                               root:str=".",          # project root directory
                               all_sheets:bool=True): # update subsheets
-    """Update metadata in a `*.sch` schematic file.
+    """Update metadata in a `*.sch` schematic file. If `all_sheets` is
+    `True`, update every sheet in the schematic hierarchy. Only sheets with
+    changed values are written.
     """
-    root = _set_root(root)
-
     if all_sheets:
-        files = glob.glob(os.path.join(root, "*.sch"))
+        schematics = get_schematic_hierarchy(root)
     else:
-        files = [get_schematic_path(root)]
+        schematics = [get_schematic(get_schematic_path(root))]
 
-    for file in files:
-        with open(file, 'r') as f:
-            schematic = f.read()
+    # Check every key first, so a missing one doesn't leave cached
+    # schematics partly updated
+    for schematic in schematics:
+        for key in update_dict:
+            if key not in schematic.title_block:
+                raise RuntimeError(f"{ key } is not in the title block of { schematic.path }.")
 
+    for schematic in schematics:
+        changed = False
         for key, value in update_dict.items():
             if not value.startswith('\"') and not value.endswith('\"'):
                 value = '\"' + value + '\"'
-            schematic, n = re.subn(f"(?s)(?P<pre>{ key } )([^\n]*)\n",
-                f"\g<pre>{ value }\n",
-                schematic
-            )
-            assert n == 1
-        with open(file, 'w') as f:
-            f.write(schematic)
+            changed |= schematic.set_title_field(key, value)
+        if changed:
+            schematic.save()
+
+# Cell
+def _cache_dir():
+    return os.getenv("KH_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "kicad_helpers"))
+
+def _output_cache_dir():
+    return os.path.join(_cache_dir(), "outputs")
+
+_file_hashes = {}
+
+def _hash_file(path):
+    """Get the sha256 hash of a file (cached until the file changes)."""
+    stamp = _stamp(path)
+    if path in _file_hashes and _file_hashes[path][0] == stamp:
+        return _file_hashes[path][1]
+    h = hashlib.sha256()
+    with trace_span("_hash_file", "io", path=path), open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    _file_hashes[path] = (stamp, h.hexdigest())
+    return _file_hashes[path][1]
+
+def _image_digest(container):
+    try:
+        with trace_span("docker image inspect", "subprocess", container=container):
+            return subprocess.check_output([_docker(), "image", "inspect", "-f", "{{.Id}}", container],
+                                           stderr=subprocess.DEVNULL).decode("utf-8").strip() or None
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+def _inputs_key(root, paths, container, *extra):
+    """Get a key for running a command in `container` on the files in `paths`
+    (and the project's `*.pro` file), or `None` if the `container` image
+    isn't available locally (e.g., it hasn't been pulled yet). Any `extra`
+    strings (e.g., the config name) are also included in the key.
+    """
+    project = get_project(root)
+    digest = _image_digest(container)
+    if digest is None:
+        return None
+    paths = list(paths)
+    pro_path = os.path.join(project.root, project.name + ".pro")
+    if os.path.exists(pro_path):
+        paths.append(pro_path)
+    h = hashlib.sha256()
+    for value in [digest] + list(extra):
+        h.update(value.encode("utf-8") + b"\0")
+    for path in paths:
+        h.update(f"{ os.path.relpath(path, project.root) }\0{ _hash_file(path) }\0".encode("utf-8"))
+    return h.hexdigest()
+
+# The files (relative to the project root, with "/" separators) that each
+# kind of input is read from, including the symbol and footprint libraries
+# and their tables (see also `kh affected`)
+_input_patterns = [("schematic", r".*\.(?:sch|lib|dcm)|(?:.*/)?sym-lib-table"),
+                   ("board", r".*\.kicad_pcb|.*\.kicad_mod|(?:.*/)?fp-lib-table"),
+                   ("project", r"[^/]*\.pro")]
+
+def _kibot_inputs(root, kinds=("schematic", "board")):
+    """Get the paths of the project files of the given `kinds` (see
+    `_input_patterns`) that KiBot reads, e.g., the schematics, the board
+    and the libraries (including `*-cache.lib`). Hidden directories and
+    directories containing another project are skipped.
+    """
+    project = get_project(root)
+    patterns = [pattern for kind, pattern in _input_patterns if kind in kinds]
+    paths = []
+    for root_, dirs, filenames in os.walk(project.root):
+        if root_ != project.root and any(filename.endswith(".pro") for filename in filenames):
+            dirs[:] = []
+            continue
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for filename in sorted(filenames):
+            path = os.path.join(root_, filename)
+            if any(re.fullmatch(pattern, os.path.relpath(path, project.root).replace(os.sep, "/"))
+                   for pattern in patterns):
+                paths.append(path)
+    return paths
+
+def _output_cache_key(config, root, container, *extra):
+    """Get the output cache key for running the KiBot `config` on the
+    project in `root` (see `_inputs_key`).
+    """
+    project = get_project(root)
+    return _inputs_key(project, _kibot_inputs(project), container, _hash_file(os.path.join(project.root, config)), *extra)
+
+def _kibot_output_dirs(config):
+    """Get the directories (relative to KiBot's output directory) that the
+    outputs of a KiBot `config` (a dictionary) are written to.
+    """
+    return sorted({out.get("dir", ".") for out in config.get("outputs") or []})
+
+# Cell
+def _output_files(path):
+    """Get a dictionary mapping the path (relative to `path`) of each file
+    in the `path` directory (skipping `.git`) to its `_stamp`.
+    """
+    files = {}
+    for root_, dirs, filenames in os.walk(path):
+        dirs[:] = [d for d in dirs if d != ".git"]
+        for filename in filenames:
+            file_path = os.path.join(root_, filename)
+            files[os.path.relpath(file_path, path)] = _stamp(file_path)
+    return files
+
+def _restore_outputs(key, output_path):
+    """Copy the files for `key` from the output cache to `output_path`.
+    Returns the list of restored files, or `None` if `key` isn't cached.
+    """
+    entry = os.path.join(_output_cache_dir(), key)
+    if not os.path.isdir(entry):
+        return None
+    files = sorted(_output_files(entry))
+    with trace_span("restore outputs", "io", key=key):
+        for file in files:
+            dst_path = os.path.join(output_path, file)
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            shutil.copyfile(os.path.join(entry, file), dst_path)
+    # Mark the entry as recently used
+    os.utime(entry)
+    return files
+
+def _store_outputs(key, output_path, files, max_size=None):
+    """Copy `files` (relative to `output_path`) to the output cache entry for
+    `key`, then evict the least recently used entries until the cache is no
+    larger than `max_size` bytes.
+    """
+    cache_dir = _output_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=cache_dir)
+    with trace_span("store outputs", "io", key=key):
+        for file in files:
+            dst_path = os.path.join(tmp, file)
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            shutil.copyfile(os.path.join(output_path, file), dst_path)
+    try:
+        os.replace(tmp, os.path.join(cache_dir, key))
+    except OSError:
+        # Another process stored the same entry first
+        shutil.rmtree(tmp)
+    _evict_outputs(max_size)
+
+def _evict_outputs(max_size=None):
+    if max_size is None:
+        max_size = int(os.getenv("KH_CACHE_SIZE", 1 << 30))
+    cache_dir = _output_cache_dir()
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if name.startswith(".") or not os.path.isdir(entry):
+            continue
+        size = sum(stamp[1] for stamp in _output_files(entry).values())
+        entries.append((os.stat(entry).st_mtime_ns, size, entry))
+    total = sum(size for mtime, size, entry in entries)
+    for mtime, size, entry in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(entry)
+        total -= size
+
+# Cell
+def _run_with_output_cache(key_fn, output_path, run, v=False, dirs=(".",)):
+    """Restore the files in `output_path` from the output cache entry for
+    `key_fn()` if there is one. Otherwise, call `run()` and store the files
+    it creates or modifies in the cache. Only files in the `dirs`
+    directories (relative to `output_path`, e.g., the `dir` of each KiBot
+    output) are stored.
+
+    Returns a `(result, hit)` tuple, where `result` is the return value of
+    `run()` (or `None` if the outputs were restored).
+    """
+    key = key_fn()
+    if key is not None:
+        files = _restore_outputs(key, output_path)
+        if files is not None:
+            if v:
+                print(f"Restored { len(files) } file{ '' if len(files) == 1 else 's' } from the output cache.")
+            return None, True
+
+    snapshot = lambda: {os.path.normpath(os.path.join(d, file)): stamp
+                        for d in dirs for file, stamp in _output_files(os.path.join(output_path, d)).items()}
+    before = snapshot()
+    result = run()
+    if key is None:
+        # The image may have been pulled by `run()`
+        key = key_fn()
+    if key is not None:
+        after = snapshot()
+        _store_outputs(key, output_path, [file for file, stamp in after.items() if before.get(file) != stamp])
+    return result, False
+
+# Cell
+Violation = namedtuple("Violation", ["category", "code", "message", "sheet", "refs", "positions", "items"])
+Violation.__doc__ = """A single ERC/DRC violation. `category` is "erc", "drc" or
+"unconnected", `code` is KiCad's error code, `sheet` is the schematic sheet
+(for ERC), `refs` are the references of the components involved, and
+`positions` are the `(x, y)` coordinates (in report units) of each of the
+`items` described in the report.
+"""
+
+_report_item = re.compile(r"^\s+@\s*\((?P<x>[-\d.]+)\s*\S*,\s*(?P<y>[-\d.]+)\s*\S*\):\s*(?P<text>.*)$")
+_report_ref = re.compile(r"\b(?:component|Cmp|Footprint|of)\s+(#?[A-Za-z_]+[0-9][\w]*)")
+
+def parse_check_report(report):
+    """Parse the text of a KiCad ERC or DRC report into a list of
+    `Violation`s.
+    """
+    violations = []
+    category = "erc"
+    sheet = None
+    current = None
+    for line in report.splitlines():
+        if line.startswith("***** Sheet "):
+            sheet = line[len("***** Sheet "):].strip()
+        elif line.startswith("** Found ") and "unconnected" in line:
+            category = "unconnected"
+        elif line.startswith("** Found "):
+            category = "drc"
+        elif line.startswith("ErrType("):
+            code, message = line[len("ErrType("):].split("):", 1)
+            current = [category, int(code), message.strip(), sheet if category == "erc" else None, [], [], []]
+            violations.append(current)
+        elif current is not None and _report_item.match(line):
+            m = _report_item.match(line)
+            current[4] += [ref for ref in _report_ref.findall(m.group("text")) if ref not in current[4]]
+            current[5].append((float(m.group("x")), float(m.group("y"))))
+            current[6].append(m.group("text").strip())
+        else:
+            current = None
+    return [Violation(*values[:4], *(tuple(value) for value in values[4:])) for values in violations]
+
+# Cell
+class CheckResult:
+    """The result of an ERC or DRC check, with the `violations` in its
+    `report` and the violations that are `new` or `resolved` compared to the
+    `previous` result (if any). `cached` is `True` if the result was
+    returned without running the check.
+    """
+    def __init__(self, kind, report, returncode=0, previous=None, cached=False):
+        self.kind = kind
+        self.report = report
+        self.returncode = returncode
+        self.cached = cached
+        self.violations = parse_check_report(report)
+        previous_violations = [] if previous is None else previous.violations
+        self.new = [v for v in self.violations if v not in previous_violations]
+        self.resolved = [v for v in previous_violations if v not in self.violations]
+
+    def __repr__(self):
+        return (f"CheckResult({ self.kind !r}, { len(self.violations) } violations, "
+                f"{ len(self.new) } new, { len(self.resolved) } resolved)")
+
+    def summary(self):
+        """Describe the new and resolved violations."""
+        lines = []
+        for label, violations in [("New", self.new), ("Resolved", self.resolved)]:
+            for v in violations:
+                where = f" on sheet { v.sheet }" if v.sheet else ""
+                refs = f" ({ ', '.join(v.refs) })" if v.refs else ""
+                lines.append(f"{ label }: ErrType({ v.code }): { v.message }{ refs }{ where }")
+        lines.append(f"{ len(self.violations) } violations ({ len(self.new) } new, { len(self.resolved) } resolved)")
+        return "\n".join(lines)
+
+# Cell
+class CheckResults:
+    """The stored ERC/DRC results for a project, keyed on a hash of each
+    check's inputs. Only the most recent `max_results` results of each kind
+    are kept.
+    """
+    max_results = 8
+
+    def __init__(self, root="."):
+        self.project = get_project(root)
+        name = hashlib.sha1(self.project.root.encode("utf-8")).hexdigest()[:12]
+        self.path = os.path.join(_cache_dir(), "checks", f"{ self.project.name }-{ name }.json")
+        try:
+            with open(self.path) as f:
+                self._data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._data = {}
+
+    def _result(self, kind, key, cached=False, compare=True):
+        results = self._data.get(kind, {}).get("results", {})
+        if key not in results:
+            return None
+        entry = results[key]
+        # Only follow `previous` one level: results can refer to each other
+        # (e.g., checking inputs A, then B, then A again)
+        previous = None
+        if compare and entry.get("previous") not in (None, key):
+            previous = self._result(kind, entry["previous"], compare=False)
+        return CheckResult(kind, entry["report"], entry["returncode"], previous=previous, cached=cached)
+
+    def get(self, kind, key):
+        """Get the stored result of the `kind` check for `key` (or `None`)."""
+        return self._result(kind, key, cached=True)
+
+    def add(self, kind, key, report, returncode=0):
+        """Store the result of a `kind` check and return it as a
+        `CheckResult` compared to the previous result.
+        """
+        data = self._data.setdefault(kind, {"last": None, "results": {}})
+        results = data["results"]
+        previous = data["last"] if data["last"] != key else results.get(key, {}).get("previous")
+        results.pop(key, None)
+        results[key] = {"report": report, "returncode": returncode, "previous": previous}
+        data["last"] = key
+        for old_key in list(results)[:-self.max_results]:
+            del results[old_key]
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._data, f)
+        os.replace(tmp_path, self.path)
+        return self._result(kind, key)
+
+# Cell
+_checks = {"erc": (["eeschema_do", "run_erc"], lambda project: _kibot_inputs(project, ["schematic"]),
+                   lambda project: project.schematic_path, lambda project: project.name + ".erc"),
+           "drc": (["pcbnew_do", "run_drc"], lambda project: _kibot_inputs(project, ["board"]),
+                   lambda project: project.board_path, lambda project: "drc_result.rpt")}
+
+def run_check(kind, root=".", v=False, cache=True):
+    """Run an ERC (`kind="erc"`) or DRC (`kind="drc"`) check in a local docker
+    container and return a `CheckResult`. If `cache` is `True` and the inputs
+    (the schematics or board and their libraries, the `*.pro` file and the
+    container image) haven't changed since a previous check, the stored
+    result is returned instead.
+    """
+    project = get_project(root)
+    cmd, inputs, path, report_name = _checks[kind]
+    container = "setsoft/kicad_auto_test:latest"
+    results = CheckResults(project)
+    key_fn = lambda: _inputs_key(project, inputs(project), container, kind)
+    key = key_fn()
+    if cache and key is not None:
+        result = results.get(kind, key)
+        if result is not None:
+            return result
+
+    returncode = 0
+    try:
+        run_docker_cmd(cmd + [path(project)[len(project.root) + 1:], "."],
+                       workdir=os.path.abspath(project.root),
+                       container=container,
+                       v=v,
+                       on_line=_print_line if v else None)
+    except subprocess.CalledProcessError as e:
+        returncode = e.returncode
+
+    report_path = os.path.join(project.root, report_name(project))
+    with open(report_path, "r") as f:
+        report = f.read()
+    os.remove(report_path)
+
+    if key is None:
+        key = key_fn()
+    if key is None:
+        return CheckResult(kind, report, returncode)
+    return results.add(kind, key, report, returncode)
 
 # Cell
 def github_badge(root="."):